@@ -0,0 +1,210 @@
+"""
+Bulk ticket classification for backlogs.
+
+Reads tickets from a CSV or JSONL file, classifies them with bounded
+concurrency while staying under a tokens-per-minute budget, and appends one
+JSON line per ticket to the output file as soon as it is done. Re-running the
+same command resumes: tickets that already have a result in the output file
+are skipped.
+
+Usage:
+    python bulk.py tickets.csv results.jsonl --concurrency 4 --tokens-per-minute 20000
+"""
+
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from preprocess import MESSAGE_TOKEN_BUDGET, REPLY_TOKEN_BUDGET, count_tokens
+
+# Rough size of the fixed prompt plus the completion budget, used to
+# estimate how many tokens a ticket will cost before sending it.
+PROMPT_OVERHEAD_TOKENS = 80
+
+# Upper bound on requests in flight for one bulk run started over HTTP.
+MAX_BULK_CONCURRENCY = int(os.environ.get("MAX_BULK_CONCURRENCY", "16"))
+
+
+def estimate_tokens(message):
+    # Messages are trimmed to the budget before they are sent.
+    message_tokens = min(count_tokens(message), MESSAGE_TOKEN_BUDGET)
+    return PROMPT_OVERHEAD_TOKENS + message_tokens + REPLY_TOKEN_BUDGET
+
+
+class TokenRateLimiter:
+    """Token bucket that refills `tokens_per_minute` tokens every minute."""
+
+    def __init__(self, tokens_per_minute):
+        self.capacity = tokens_per_minute
+        self.tokens = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens):
+        # A single ticket larger than the whole budget still has to go through.
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_for = (tokens - self.tokens) / self.rate
+            time.sleep(wait_for)
+
+
+def parse_tickets(lines, fmt, id_field="id", message_field="message"):
+    """
+    Yield {"id", "message"} dicts from CSV or JSONL lines. Rows without an id
+    get "row-<n>", which cannot clash with a numeric id from another row.
+    """
+    if fmt == "csv":
+        rows = csv.DictReader(lines)
+    else:
+        rows = (json.loads(line) for line in lines if line.strip())
+
+    for number, row in enumerate(rows, 1):
+        message = (row.get(message_field) or "").strip()
+        if not message:
+            continue
+        ticket_id = row.get(id_field)
+        if ticket_id is None or ticket_id == "":
+            ticket_id = f"row-{number}"
+        yield {"id": str(ticket_id), "message": message}
+
+
+def read_tickets(path, id_field="id", message_field="message"):
+    fmt = "csv" if path.lower().endswith(".csv") else "jsonl"
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from parse_tickets(f, fmt, id_field, message_field)
+
+
+def completed_ids(output_path):
+    """Ids that already have a successful result in an earlier run's output."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Last line of a run that was killed mid-write.
+                continue
+            if "error" not in record:
+                done.add(record["id"])
+    return done
+
+
+def drop_partial_line(output_path):
+    """Cut off a last line that a killed run left without its newline."""
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - 4096)
+            f.seek(start)
+            chunk = f.read(position - start)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                position = start + newline + 1
+                break
+            position = start
+        if position != end:
+            f.truncate(position)
+
+
+def _classify_one(classify, limiter, ticket):
+    if limiter is not None:
+        limiter.acquire(estimate_tokens(ticket["message"]))
+    try:
+        result = classify(ticket["message"])
+        if hasattr(result, "to_dict"):
+            result = result.to_dict()
+        return {"id": ticket["id"], "result": result}
+    except Exception as e:
+        return {"id": ticket["id"], "error": str(e)}
+
+
+def classify_tickets(tickets, classify, concurrency=4, limiter=None, skip_ids=()):
+    """
+    Classify tickets with at most `concurrency` requests in flight and yield
+    result records in completion order. Failures are yielded as records with
+    an "error" key instead of stopping the batch.
+    """
+    tickets = (t for t in tickets if t["id"] not in skip_ids)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = set()
+        for ticket in tickets:
+            pending.add(pool.submit(_classify_one, classify, limiter, ticket))
+            if len(pending) >= concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+        for future in pending:
+            yield future.result()
+
+
+def run(input_path, output_path, classify, concurrency=4, tokens_per_minute=None,
+        id_field="id", message_field="message"):
+    skip_ids = completed_ids(output_path)
+    # Appending after a torn line would glue the first new record onto it.
+    drop_partial_line(output_path)
+    if skip_ids:
+        print(f"Resuming: {len(skip_ids)} tickets already done")
+
+    limiter = TokenRateLimiter(tokens_per_minute) if tokens_per_minute else None
+    tickets = read_tickets(input_path, id_field, message_field)
+
+    processed = failed = 0
+    with open(output_path, "a", encoding="utf-8") as out:
+        for record in classify_tickets(tickets, classify, concurrency, limiter, skip_ids):
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            processed += 1
+            if "error" in record:
+                failed += 1
+            if processed % 50 == 0:
+                print(f"{processed} tickets processed ({failed} failed)")
+
+    print(f"Done: {processed} tickets processed ({failed} failed)")
+    return processed, failed
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify a backlog of support tickets")
+    parser.add_argument("input", help="CSV or JSONL file with one ticket per row")
+    parser.add_argument("output", help="JSONL file results are appended to")
+    parser.add_argument("--concurrency", type=positive_int, default=4)
+    parser.add_argument("--tokens-per-minute", type=int, default=None)
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--message-field", default="message")
+    args = parser.parse_args()
+
+    from main import process_message
+
+    run(args.input, args.output, process_message, args.concurrency,
+        args.tokens_per_minute, args.id_field, args.message_field)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,36 @@
-from flask import Flask, render_template, request
-from groq import Groq
+import dataclasses
+import io
+import json
+import os
+import time
+
+from flask import Flask, Response, g, jsonify, render_template, request, stream_with_context
+
+from bulk import MAX_BULK_CONCURRENCY, TokenRateLimiter, classify_tickets, parse_tickets
+from preprocess import REPLY_TOKEN_BUDGET, count_tokens, prepare_message
+from providers import get_provider
+from replies import MalformedReply, SupportReply, parse_reply
+from stats import InstrumentedProvider, ReplyCache, Stats
 
 app = Flask(__name__)
 
-client = Groq(api_key="USE YOUR OWN API KEY")
+stats = Stats()
 
-def process_message(message):
+# Chosen with LLM_PROVIDER (groq, local or mock); see providers.py.
+provider = InstrumentedProvider(get_provider(), stats)
+
+# Identical (trimmed) messages get the same answer; 0 turns the cache off.
+reply_cache = ReplyCache(int(os.environ.get("REPLY_CACHE_SIZE", "1024")), stats)
+
+REPAIR_PROMPT = (
+    "Your answer did not follow the format. Reply again with exactly three lines:\n"
+    "Category: <one of Complaint, Refund/Return, Sales Inquiry, Delivery Question, "
+    "Account/Technical Issue, General Query, Spam>\n"
+    "Sentiment: <Positive, Neutral or Negative>\n"
+    "Auto-Reply: <the reply>"
+)
+
+def build_messages(message):
     prompt = f"""
 You are a customer support AI.
 
@@ -22,16 +47,106 @@ Customer Message:
 "{message}"
 """
 
-    response = client.chat.completions.create(
-        model="llama-3.1-8b-instant",
-        messages=[
-            {"role": "system", "content": "You are a precise customer support assistant."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=120
-    )
+    return [
+        {"role": "system", "content": "You are a precise customer support assistant."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def prompt_tokens(messages):
+    return sum(count_tokens(m["content"]) for m in messages)
+
+
+def cached_reply(prepared):
+    cached = reply_cache.get(prepared.text)
+    if cached is not None:
+        return dataclasses.replace(cached, usage={**cached.usage, "cached": True})
+    return None
+
+
+def start_request(prepared):
+    """Prompt messages for a prepared message and the usage record that goes with them."""
+    messages = build_messages(prepared.text)
+    usage = {
+        "message_tokens": prepared.original_tokens,
+        "trimmed_message_tokens": prepared.tokens,
+        "truncated": prepared.truncated,
+        "prompt_tokens": prompt_tokens(messages),
+        "max_completion_tokens": REPLY_TOKEN_BUDGET,
+    }
+    return messages, usage
+
+
+def finish_reply(prepared, messages, usage, text):
+    """Parse the model's text (with one repair retry), log the usage and cache the reply."""
+    try:
+        reply = parse_reply(text)
+    except MalformedReply:
+        # One cheap retry: show the model its own answer and ask for the format again.
+        messages += [
+            {"role": "assistant", "content": text},
+            {"role": "user", "content": REPAIR_PROMPT}
+        ]
+        usage["prompt_tokens"] += prompt_tokens(messages)
+        usage["retried"] = True
+        text = provider.complete(messages, REPLY_TOKEN_BUDGET)
+        try:
+            reply = parse_reply(text)
+        except MalformedReply as e:
+            e.text = text
+            raise
+
+    reply.usage = usage
+    app.logger.info("Processed message: %s", usage)
+    reply_cache.put(prepared.text, reply)
+    return reply
+
+
+def process_message(message):
+    """Classify a message and return a validated SupportReply."""
+    prepared = prepare_message(message)
+    cached = cached_reply(prepared)
+    if cached is not None:
+        return cached
+
+    messages, usage = start_request(prepared)
+    text = provider.complete(messages, REPLY_TOKEN_BUDGET)
+    return finish_reply(prepared, messages, usage, text)
+
 
-    return response.choices[0].message.content.strip()
+def stream_message(message):
+    """
+    Yield the reply text piece by piece as the model produces it, then the
+    validated SupportReply. Goes through the same cache, retry and usage log
+    as process_message.
+    """
+    prepared = prepare_message(message)
+    cached = cached_reply(prepared)
+    if cached is not None:
+        yield str(cached)
+        yield cached
+        return
+
+    messages, usage = start_request(prepared)
+    text = ""
+    for token in provider.stream(messages, REPLY_TOKEN_BUDGET):
+        text += token
+        yield token
+    yield finish_reply(prepared, messages, usage, text)
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    # Streaming responses are timed until the headers go out, not until the last token.
+    if "request_start" in g:
+        elapsed_ms = (time.perf_counter() - g.request_start) * 1000
+        stats.record_request(request.endpoint or "unknown", response.status_code, elapsed_ms)
+    return response
 
 
 @app.route("/", methods=["GET", "POST"])
@@ -41,10 +156,87 @@ def index():
     if request.method == "POST":
         user_message = request.form.get("message")
         if user_message:
-            result = process_message(user_message)
+            try:
+                result = process_message(user_message)
+            except MalformedReply as e:
+                # Still unusable after the retry: show what the model said, like /bulk records the error.
+                result = e.text or f"Could not read the model's reply: {e}"
 
     return render_template("index.html", result=result)
 
 
+@app.route("/stream", methods=["POST"])
+def stream():
+    """
+    Server-sent events: one "data" event per token, then a "done" event
+    carrying the validated Category/Sentiment/Auto-Reply fields and usage.
+    """
+    user_message = request.form.get("message") or request.get_data(as_text=True)
+
+    def generate():
+        result = {}
+        try:
+            for item in stream_message(user_message):
+                if isinstance(item, SupportReply):
+                    result = item.to_dict()
+                else:
+                    yield f"data: {json.dumps({'token': item})}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+            result = {}
+        yield f"event: done\ndata: {json.dumps(result)}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.route("/bulk", methods=["POST"])
+def bulk():
+    """
+    Classify many tickets in one request. Accepts a CSV or JSONL upload in the
+    "file" field (or as the raw body) and streams back one JSON line per ticket.
+    """
+    upload = request.files.get("file")
+    if upload:
+        text = upload.read().decode("utf-8")
+        name = upload.filename or ""
+    else:
+        text = request.get_data(as_text=True)
+        name = ""
+
+    fmt = "csv" if name.lower().endswith(".csv") or request.mimetype == "text/csv" else "jsonl"
+    tickets = list(parse_tickets(io.StringIO(text), fmt))
+
+    # Checked before streaming starts: afterwards the 200 status is already sent.
+    try:
+        concurrency = int(request.args.get("concurrency", "4"))
+    except ValueError:
+        concurrency = 0
+    if concurrency < 1:
+        return jsonify(error="concurrency must be a positive integer"), 400
+    concurrency = min(concurrency, MAX_BULK_CONCURRENCY)
+    tokens_per_minute = request.args.get("tokens_per_minute", type=int)
+    limiter = TokenRateLimiter(tokens_per_minute) if tokens_per_minute else None
+
+    def generate():
+        for record in classify_tickets(tickets, process_message, concurrency, limiter):
+            yield json.dumps(record) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@app.route("/stats")
+def stats_json():
+    return jsonify(provider=provider.name, **stats.snapshot())
+
+
+@app.route("/admin/stats")
+def stats_page():
+    return render_template("stats.html", provider=provider.name, stats=stats.snapshot())
+
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,132 @@
+"""
+Clean up customer messages before they go into the prompt.
+
+Pasted emails often carry the whole quoted thread, signatures and repeated
+paragraphs. prepare_message() strips those and truncates what is left to a
+token budget, so every ticket costs a bounded number of prompt tokens.
+"""
+
+import os
+import re
+from dataclasses import dataclass
+
+# Budget for the customer message itself; the fixed instructions come on top.
+MESSAGE_TOKEN_BUDGET = int(os.environ.get("MESSAGE_TOKEN_BUDGET", "600"))
+
+# Completion budget: three short lines, so this rarely needs changing.
+REPLY_TOKEN_BUDGET = int(os.environ.get("MAX_REPLY_TOKENS", "120"))
+
+TRUNCATION_MARKER = " [...]"
+
+try:
+    import tiktoken
+
+    # Not Llama's tokenizer, but within a few percent of it on English text.
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+# Fallback when tiktoken isn't installed: words, numbers and punctuation each
+# count as a token, long words as one token per 4 characters.
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Lines that start the quoted part of a reply; everything after is dropped.
+_QUOTE_HEADERS = [
+    re.compile(r"^On .+ wrote:\s*$"),
+    re.compile(r"^-{2,}\s*Original Message\s*-{2,}", re.IGNORECASE),
+    re.compile(r"^-{2,}\s*Forwarded message\s*-{2,}", re.IGNORECASE),
+    re.compile(r"^From:\s.+", re.IGNORECASE),
+    re.compile(r"^_{10,}\s*$"),
+]
+
+# Signature openers; only honoured near the end of the message.
+_SIGNATURE_STARTS = re.compile(
+    r"^(--\s*|best( regards)?,?|kind regards,?|regards,?|thanks( again)?,?|thank you,?|cheers,?|"
+    r"sincerely,?|sent from my .+|get outlook for .+)$",
+    re.IGNORECASE
+)
+SIGNATURE_MAX_LINES = 8
+
+
+@dataclass
+class PreparedMessage:
+    text: str
+    original_tokens: int
+    tokens: int
+    truncated: bool
+
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return sum(max(1, len(piece) // 4) for piece in _TOKEN_PATTERN.findall(text))
+
+
+def strip_quoted_thread(text):
+    kept = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if kept and any(pattern.match(stripped) for pattern in _QUOTE_HEADERS):
+            break
+        if stripped.startswith(">"):
+            continue
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def strip_signature(text):
+    lines = text.rstrip().splitlines()
+    # Never cut the first line: "Thanks, the order arrived" is a message, not a sign-off.
+    start = max(1, len(lines) - SIGNATURE_MAX_LINES)
+    for i in range(start, len(lines)):
+        if _SIGNATURE_STARTS.match(lines[i].strip()):
+            return "\n".join(lines[:i])
+    return "\n".join(lines)
+
+
+def dedupe_paragraphs(text):
+    seen = set()
+    paragraphs = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        key = " ".join(paragraph.split()).lower()
+        if key and key not in seen:
+            seen.add(key)
+            paragraphs.append(paragraph.strip())
+    return "\n\n".join(paragraphs)
+
+
+def truncate_to_tokens(text, budget):
+    if count_tokens(text) <= budget:
+        return text
+    budget = max(0, budget - count_tokens(TRUNCATION_MARKER))
+
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text)[:budget]) + TRUNCATION_MARKER
+
+    # Without a tokenizer, cut at the end of the last fallback token that fits.
+    used = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        used += max(1, len(match.group()) // 4)
+        if used > budget:
+            return text[:match.start()].rstrip() + TRUNCATION_MARKER
+    return text
+
+
+def prepare_message(message, budget=MESSAGE_TOKEN_BUDGET):
+    original_tokens = count_tokens(message)
+
+    text = strip_quoted_thread(message)
+    text = strip_signature(text)
+    text = dedupe_paragraphs(text)
+    # A message that was nothing but a quote is better sent as-is than empty.
+    if not text.strip():
+        text = message.strip()
+
+    truncated_text = truncate_to_tokens(text, budget)
+
+    return PreparedMessage(
+        text=truncated_text,
+        original_tokens=original_tokens,
+        tokens=count_tokens(truncated_text),
+        truncated=truncated_text != text
+    )
@@ -0,0 +1,184 @@
+"""
+LLM backends for the support assistant.
+
+Pick one with the LLM_PROVIDER environment variable:
+    groq   - Groq Cloud (needs GROQ_API_KEY)
+    local  - any OpenAI-compatible server, e.g. llama.cpp, vLLM or Ollama
+             (LOCAL_LLM_URL, default http://localhost:8000/v1)
+    mock   - deterministic offline replies for tests, benchmarks and load tests
+             (MOCK_LATENCY_MS adds a fixed delay per call)
+"""
+
+import json
+import os
+import time
+
+import requests
+
+DEFAULT_MODEL = "llama-3.1-8b-instant"
+
+
+class LLMProvider:
+    """Common interface: a full completion, or the same completion as a token stream."""
+
+    name = "base"
+
+    def complete(self, messages, max_tokens):
+        raise NotImplementedError
+
+    def stream(self, messages, max_tokens):
+        raise NotImplementedError
+
+
+class GroqProvider(LLMProvider):
+    name = "groq"
+
+    def __init__(self, api_key=None, model=None):
+        self.api_key = api_key or os.environ.get("GROQ_API_KEY")
+        self.model = model or os.environ.get("GROQ_MODEL", DEFAULT_MODEL)
+        self._client = None
+
+    @property
+    def client(self):
+        # Created on first use so importing the app never needs a key.
+        if self._client is None:
+            import httpx
+            from groq import Groq
+
+            if not self.api_key:
+                raise RuntimeError("GROQ_API_KEY is not set")
+
+            # One client, and one keep-alive connection pool, shared by every request and stream.
+            self._client = Groq(
+                api_key=self.api_key,
+                http_client=httpx.Client(
+                    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+                )
+            )
+        return self._client
+
+    def complete(self, messages, max_tokens):
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens
+        )
+        return response.choices[0].message.content.strip()
+
+    def stream(self, messages, max_tokens):
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        for chunk in stream:
+            token = chunk.choices[0].delta.content
+            if token:
+                yield token
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    name = "local"
+
+    def __init__(self, base_url=None, model=None, api_key=None, timeout=60):
+        self.base_url = (base_url or os.environ.get("LOCAL_LLM_URL", "http://localhost:8000/v1")).rstrip("/")
+        self.model = model or os.environ.get("LOCAL_LLM_MODEL", DEFAULT_MODEL)
+        self.api_key = api_key or os.environ.get("LOCAL_LLM_API_KEY", "not-needed")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {self.api_key}"
+
+    def _post(self, messages, max_tokens, stream):
+        response = self.session.post(
+            f"{self.base_url}/chat/completions",
+            json={
+                "model": self.model,
+                "messages": messages,
+                "max_tokens": max_tokens,
+                "stream": stream
+            },
+            timeout=self.timeout,
+            stream=stream
+        )
+        response.raise_for_status()
+        return response
+
+    def complete(self, messages, max_tokens):
+        data = self._post(messages, max_tokens, stream=False).json()
+        return data["choices"][0]["message"]["content"].strip()
+
+    def stream(self, messages, max_tokens):
+        response = self._post(messages, max_tokens, stream=True)
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: "):
+                continue
+            data = line[len("data: "):]
+            if data == "[DONE]":
+                break
+            token = json.loads(data)["choices"][0]["delta"].get("content")
+            if token:
+                yield token
+
+
+class MockProvider(LLMProvider):
+    """Keyword rules instead of a model: same input, same reply, no network."""
+
+    name = "mock"
+
+    RULES = [
+        (("refund", "return", "money back"), "Refund/Return", "Negative",
+         "We're sorry about this. We have started your refund and will email you the details shortly."),
+        (("damaged", "broken", "terrible", "worst", "angry"), "Complaint", "Negative",
+         "We sincerely apologize for the trouble. A support agent will contact you today to make this right."),
+        (("delivery", "shipping", "arrive", "tracking"), "Delivery Question", "Neutral",
+         "Thanks for reaching out. Your order is on its way and you can follow it with the tracking link in your email."),
+        (("password", "login", "account", "error"), "Account/Technical Issue", "Neutral",
+         "Thanks for letting us know. Please try resetting your password; if that fails, reply and we'll help directly."),
+        (("price", "buy", "discount", "quote"), "Sales Inquiry", "Positive",
+         "Thanks for your interest! Our sales team will send you pricing and availability shortly."),
+        (("click here", "winner", "free money"), "Spam", "Neutral",
+         "No reply needed."),
+    ]
+
+    def __init__(self, latency_ms=None):
+        if latency_ms is None:
+            latency_ms = float(os.environ.get("MOCK_LATENCY_MS", "0"))
+        self.latency = latency_ms / 1000.0
+
+    def _reply(self, messages):
+        text = messages[-1]["content"].lower()
+        # Only look at the customer's message, not the instructions around it.
+        text = text.split("customer message:", 1)[-1]
+
+        category, sentiment, reply = "General Query", "Neutral", "Thanks for contacting us. We'll get back to you shortly."
+        for keywords, rule_category, rule_sentiment, rule_reply in self.RULES:
+            if any(keyword in text for keyword in keywords):
+                category, sentiment, reply = rule_category, rule_sentiment, rule_reply
+                break
+        return f"Category: {category}\nSentiment: {sentiment}\nAuto-Reply: {reply}"
+
+    def complete(self, messages, max_tokens):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._reply(messages)
+
+    def stream(self, messages, max_tokens):
+        if self.latency:
+            time.sleep(self.latency)
+        for word in self._reply(messages).split(" "):
+            yield word + " "
+
+
+PROVIDERS = {
+    "groq": GroqProvider,
+    "local": OpenAICompatibleProvider,
+    "mock": MockProvider,
+}
+
+
+def get_provider(name=None):
+    name = (name or os.environ.get("LLM_PROVIDER", "groq")).lower()
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider '{name}'. Choose from: {', '.join(PROVIDERS)}")
+    return PROVIDERS[name]()
@@ -0,0 +1,100 @@
+"""
+Typed parsing of the model's three-line reply.
+"""
+
+import re
+from dataclasses import asdict, dataclass, field
+
+CATEGORIES = (
+    "Complaint",
+    "Refund/Return",
+    "Sales Inquiry",
+    "Delivery Question",
+    "Account/Technical Issue",
+    "General Query",
+    "Spam",
+)
+
+SENTIMENTS = ("Positive", "Neutral", "Negative")
+
+# Short forms models use for a label; anything not listed here is rejected.
+ALIASES = {
+    "refund": "Refund/Return",
+    "return": "Refund/Return",
+    "refunds/returns": "Refund/Return",
+    "refund/returns": "Refund/Return",
+    "sales": "Sales Inquiry",
+    "sales enquiry": "Sales Inquiry",
+    "delivery": "Delivery Question",
+    "delivery inquiry": "Delivery Question",
+    "shipping question": "Delivery Question",
+    "account issue": "Account/Technical Issue",
+    "technical issue": "Account/Technical Issue",
+    "account/technical": "Account/Technical Issue",
+    "general inquiry": "General Query",
+    "general enquiry": "General Query",
+}
+
+# Models sometimes wrap labels in markdown, e.g. "**Category:** Complaint".
+FIELD_PATTERN = re.compile(r"^[\s*_#-]*(category|sentiment|auto[- ]?reply)[\s*_]*:[\s*_]*(.*)$", re.IGNORECASE)
+
+
+class MalformedReply(ValueError):
+    """The model's output does not match the Category/Sentiment/Auto-Reply schema."""
+
+    # The raw model output that failed to parse, when the caller has it.
+    text = None
+
+
+@dataclass
+class SupportReply:
+    category: str
+    sentiment: str
+    auto_reply: str
+    # Token counts for the request that produced this reply.
+    usage: dict = field(default_factory=dict, compare=False)
+
+    def to_dict(self):
+        return asdict(self)
+
+    def __str__(self):
+        return f"Category: {self.category}\nSentiment: {self.sentiment}\nAuto-Reply: {self.auto_reply}"
+
+
+def _canonical(value, allowed, field):
+    cleaned = re.sub(r"\s*/\s*", "/", value.strip().strip(".*_ ").lower())
+    for option in allowed:
+        if cleaned == option.lower():
+            return option
+    if ALIASES.get(cleaned) in allowed:
+        return ALIASES[cleaned]
+    raise MalformedReply(f"Invalid {field}: '{value.strip()}'")
+
+
+def parse_reply(text):
+    """Parse and validate a reply; raises MalformedReply when it can't."""
+    fields = {}
+    current = None
+
+    for line in text.strip().splitlines():
+        match = FIELD_PATTERN.match(line)
+        if match:
+            current = match.group(1).lower().replace(" ", "-")
+            if current == "autoreply":
+                current = "auto-reply"
+            if current in fields:
+                raise MalformedReply(f"Repeated field: {current}")
+            fields[current] = match.group(2).strip()
+        elif current == "auto-reply" and line.strip():
+            # The auto-reply is the only field allowed to span several lines.
+            fields[current] += "\n" + line.strip()
+
+    missing = [name for name in ("category", "sentiment", "auto-reply") if not fields.get(name)]
+    if missing:
+        raise MalformedReply(f"Missing field(s): {', '.join(missing)}")
+
+    return SupportReply(
+        category=_canonical(fields["category"], CATEGORIES, "category"),
+        sentiment=_canonical(fields["sentiment"], SENTIMENTS, "sentiment"),
+        auto_reply=fields["auto-reply"].strip()
+    )
@@ -0,0 +1,195 @@
+"""
+In-memory latency, token and error statistics for the admin stats page.
+
+Everything is bounded: latencies go into fixed histogram buckets plus a
+ring buffer of recent samples for percentiles, so memory use does not grow
+with traffic.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+from preprocess import count_tokens
+
+# Upper bounds of the latency buckets, in milliseconds.
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 2000, 5000, 10000, float("inf")]
+RECENT_SAMPLES = 1000
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS, recent=RECENT_SAMPLES):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.recent = deque(maxlen=recent)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def add(self, ms):
+        for i, bound in enumerate(self.buckets):
+            if ms <= bound:
+                self.counts[i] += 1
+                break
+        self.recent.append(ms)
+        self.count += 1
+        self.total_ms += ms
+
+    def percentile(self, p):
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 1)
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 1) if self.count else None,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "buckets": {
+                ("+inf" if bound == float("inf") else f"<={bound}"): n
+                for bound, n in zip(self.buckets, self.counts)
+            },
+        }
+
+
+class Stats:
+    """Thread-safe counters shared by every request."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.upstream = LatencyHistogram()
+        self.first_token = LatencyHistogram()
+        self.requests = LatencyHistogram()
+        self.upstream_calls = 0
+        self.upstream_errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.responses_by_status = {}
+        self.errors_by_endpoint = {}
+
+    def record_upstream(self, ms, prompt_tokens, completion_tokens, error=False):
+        with self.lock:
+            self.upstream.add(ms)
+            self.upstream_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            if error:
+                self.upstream_errors += 1
+
+    def record_first_token(self, ms):
+        with self.lock:
+            self.first_token.add(ms)
+
+    def record_cache(self, hit):
+        with self.lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    def record_request(self, endpoint, status, ms):
+        with self.lock:
+            self.requests.add(ms)
+            self.responses_by_status[status] = self.responses_by_status.get(status, 0) + 1
+            if status >= 500:
+                self.errors_by_endpoint[endpoint] = self.errors_by_endpoint.get(endpoint, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            lookups = self.cache_hits + self.cache_misses
+            calls = self.upstream_calls
+            return {
+                "uptime_s": round(time.time() - self.started),
+                "upstream": {
+                    "calls": calls,
+                    "errors": self.upstream_errors,
+                    "latency": self.upstream.snapshot(),
+                    "time_to_first_token": self.first_token.snapshot(),
+                },
+                "tokens": {
+                    "prompt": self.prompt_tokens,
+                    "completion": self.completion_tokens,
+                    "prompt_per_call": round(self.prompt_tokens / calls, 1) if calls else None,
+                    "completion_per_call": round(self.completion_tokens / calls, 1) if calls else None,
+                },
+                "cache": {
+                    "hits": self.cache_hits,
+                    "misses": self.cache_misses,
+                    "hit_rate": round(self.cache_hits / lookups, 3) if lookups else None,
+                },
+                "requests": {
+                    "latency": self.requests.snapshot(),
+                    "by_status": {str(k): v for k, v in sorted(self.responses_by_status.items())},
+                    "errors_by_endpoint": dict(self.errors_by_endpoint),
+                },
+            }
+
+
+class InstrumentedProvider:
+    """Wraps an LLMProvider and records latency, token counts and errors per call."""
+
+    def __init__(self, provider, stats):
+        self.provider = provider
+        self.stats = stats
+        self.name = provider.name
+
+    def complete(self, messages, max_tokens):
+        start = time.perf_counter()
+        prompt = sum(count_tokens(m["content"]) for m in messages)
+        try:
+            text = self.provider.complete(messages, max_tokens)
+        except Exception:
+            self.stats.record_upstream((time.perf_counter() - start) * 1000, prompt, 0, error=True)
+            raise
+        self.stats.record_upstream((time.perf_counter() - start) * 1000, prompt, count_tokens(text))
+        return text
+
+    def stream(self, messages, max_tokens):
+        start = time.perf_counter()
+        prompt = sum(count_tokens(m["content"]) for m in messages)
+        text = ""
+        try:
+            for token in self.provider.stream(messages, max_tokens):
+                if not text:
+                    self.stats.record_first_token((time.perf_counter() - start) * 1000)
+                text += token
+                yield token
+        except Exception:
+            self.stats.record_upstream((time.perf_counter() - start) * 1000, prompt, count_tokens(text), error=True)
+            raise
+        self.stats.record_upstream((time.perf_counter() - start) * 1000, prompt, count_tokens(text))
+
+
+class ReplyCache:
+    """Small LRU of parsed replies keyed on the trimmed message text."""
+
+    def __init__(self, maxsize, stats=None):
+        self.maxsize = maxsize
+        self.stats = stats
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        if not self.maxsize:
+            return None
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+        if self.stats is not None:
+            self.stats.record_cache(value is not None)
+        return value
+
+    def put(self, key, value):
+        if not self.maxsize:
+            return
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
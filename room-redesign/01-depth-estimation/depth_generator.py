@@ -4,37 +4,169 @@ Takes room images and generates depth maps using MiDaS model
 """
 
 import os
+import sys
+import json
+import shutil
+import hashlib
 import torch
 import cv2
 import numpy as np
 from PIL import Image
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import model_store
+from utils.depth_store import DepthStore
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+class DepthCache:
+    """
+    Manifest of depth maps already generated in an output folder.
+    Each entry is keyed on the input image's content hash plus a hash of the
+    model and transform settings, so an unchanged image is never recomputed
+    and any change to the model or settings invalidates every entry.
+    With a raw_format, an entry only counts while its raw depth is there too.
+    """
+    
+    MANIFEST_NAME = "depth_manifest.json"
+    
+    def __init__(self, output_folder, settings, raw_format=None):
+        self.path = os.path.join(output_folder, self.MANIFEST_NAME)
+        self.settings = settings
+        self.raw_format = raw_format
+        self.store = DepthStore(output_folder) if raw_format == 'store' else None
+        self.settings_hash = hashlib.sha256(
+            json.dumps(settings, sort_keys=True).encode()
+        ).hexdigest()
+        self.entries = {}
+        
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.entries = json.load(f).get("entries", {})
+            except (ValueError, OSError) as e:
+                print(f"⚠️ Ignoring unreadable depth manifest: {e}")
+    
+    def key(self, image_path):
+        """Content hash of the image combined with the settings hash"""
+        digest = hashlib.sha256(self.settings_hash.encode())
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def lookup(self, image_file, key, output_path, allow_copy=True):
+        """
+        Return True if output_path already holds the result for this key.
+        A renamed or duplicated image is served by copying the existing output.
+        """
+        entry = self.entries.get(image_file)
+        if entry and entry["key"] == key and self.has_outputs(output_path):
+            return True
+        if not allow_copy:
+            return False
+        
+        for other in list(self.entries.values()):
+            if other["key"] == key and self.has_outputs(other["output"]):
+                if os.path.abspath(other["output"]) != os.path.abspath(output_path):
+                    shutil.copyfile(other["output"], output_path)
+                self.entries[image_file] = {"key": key, "output": output_path}
+                return True
+        return False
+    
+    def has_outputs(self, output_path):
+        """The PNG preview exists, and so does the raw depth when one is kept"""
+        if not os.path.exists(output_path):
+            return False
+        name = os.path.basename(output_path)[:-len("_depth.png")]
+        if self.raw_format == 'npy':
+            return os.path.exists(os.path.join(os.path.dirname(output_path), f"{name}_depth.npy"))
+        if self.raw_format == 'store':
+            return name in self.store and os.path.exists(self.store.data_path)
+        return True
+    
+    def update(self, image_file, key, output_path):
+        self.entries[image_file] = {"key": key, "output": output_path}
+    
+    def save(self):
+        # Write to a temp file first so a crash never leaves a half-written manifest
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"settings": self.settings, "entries": self.entries}, f, indent=2)
+        os.replace(tmp_path, self.path)
 
 class DepthGenerator:
-    def __init__(self):
-        """Initialize the depth generator with MiDaS model"""
+    MODEL_REPO = "intel-isl/MiDaS"
+    MODEL_NAME = "MiDaS_small"
+    
+
+    RAW_FORMATS = (None, 'npy', 'store')
+    
+    def __init__(self, model_dir=None, raw_format=None, raw_dtype='float32',
+                 tile_size=None, tile_overlap=128, tile_workers=4):
+        """
+        Initialize the depth generator with MiDaS model.
+        Uses the local model store when it has been exported
+        (python -m utils.model_store export), otherwise torch.hub.
+        
+        raw_format keeps the un-normalized depth next to the uint8 PNG preview:
+        'npy' writes <name>_depth.npy, 'store' appends to one memory-mapped
+        depth_store.bin per output folder (see utils/depth_store.py).
+        raw_dtype is 'float32' or 'float16'.
+        
+        tile_size enables tiled inference for images larger than one tile:
+        overlapping tiles of tile_size pixels are run on tile_workers threads
+        and blended into a full-resolution map (see generate_depth_map_tiled).
+        """
+        if raw_format not in self.RAW_FORMATS:
+            raise ValueError(f"raw_format must be one of {self.RAW_FORMATS}")
+        self.raw_format = raw_format
+        self.raw_dtype = np.dtype(raw_dtype)
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_workers = tile_workers
+        
         print("🔄 Initializing Depth Generator...")
-        print("   This will download the MiDaS model (first time only)...")
         
-        # Load MiDaS model - using small version for CPU
-        self.midas = torch.hub.load("intel-isl/MiDaS", "MiDaS_small")
-        self.midas.eval()
+        if model_store.has_midas_small(model_dir):
+            # Offline: TorchScript artifact plus a local copy of the transform
+            print("   Loading MiDaS from local model store...")
+            self.midas = model_store.load_midas_small(model_dir)
+            self.transform = model_store.midas_small_transform
+        else:
+            print("   This will download the MiDaS model (first time only)...")
+            
+            # Load MiDaS model - using small version for CPU
+            self.midas = torch.hub.load(self.MODEL_REPO, self.MODEL_NAME)
+            self.midas.eval()
+            
+            # Load transforms
+            midas_transforms = torch.hub.load(self.MODEL_REPO, "transforms")
+            self.transform = midas_transforms.small_transform
         
-        # Load transforms
-        midas_transforms = torch.hub.load("intel-isl/MiDaS", "transforms")
-        self.transform = midas_transforms.small_transform
+        # Everything that changes the output; part of every depth cache key
+        self.settings = {
+            "model": f"{self.MODEL_REPO}:{self.MODEL_NAME}",
+            "transform": "small_transform",
+            "upsample": "bicubic",
+            "output": "png-uint8-minmax",
+            "raw": f"{raw_format}-{self.raw_dtype.name}" if raw_format else None,
+            "tiling": f"{tile_size}/{tile_overlap}" if tile_size else None,
+        }
         
         print("✅ Depth Generator initialized")
         
-    def generate_depth_map(self, image_path, output_path):
+    def load_image(self, image_path):
         """
-        Generate depth map from an image
+        Decode an image and apply the MiDaS transform.
+        Returns the RGB array and its [1, 3, H, W] input tensor.
         """
-        print(f"📸 Processing: {os.path.basename(image_path)}")
-        
-        # Load image using PIL
         img = Image.open(image_path).convert('RGB')
-        img_np = np.array(img)
-        
+        return self.prepare_image(np.array(img))
+    
+    def prepare_image(self, img_np):
+        """MiDaS transform for an already decoded [H, W, 3] RGB array"""
         # Apply transforms - this returns [1, 3, H, W]
         input_tensor = self.transform(img_np)
         
@@ -42,53 +174,284 @@ class DepthGenerator:
         if input_tensor.dim() == 5:  # [1, 1, 3, H, W] -> [1, 3, H, W]
             input_tensor = input_tensor.squeeze(1)
         
-        # Generate depth map
+        return img_np, input_tensor
+    
+    def normalize_depth(self, depth):
+        """
+        Scale each depth map in a [B, H, W] batch to 0-255 (one min/max per map)
+        """
+        flat = depth.flatten(1)
+        depth_min = flat.min(dim=1).values.view(-1, 1, 1)
+        depth_max = flat.max(dim=1).values.view(-1, 1, 1)
+        scale = (depth_max - depth_min).clamp_min(1e-8)
+        return ((depth - depth_min) / scale * 255).to(torch.uint8)
+    
+    def infer_batch(self, input_tensors, output_size):
+        """
+        Run MiDaS on tensors that share one transformed size and upsample the
+        results to `output_size` (H, W). Returns [B, H, W] uint8 previews and,
+        when a raw format is set, the raw depth in raw_dtype (else None).
+        MiDaS predicts relative inverse depth, so raw values are comparable
+        across images only up to a per-image scale and shift.
+        """
         with torch.no_grad():
-            depth = self.midas(input_tensor)
-            
-            # Resize to original size
-            depth = torch.nn.functional.interpolate(
-                depth.unsqueeze(1),
-                size=img_np.shape[:2],
-                mode="bicubic",
-                align_corners=False,
-            ).squeeze()
+            depth = self.predict(torch.cat(input_tensors, dim=0), output_size)
+            depth_norm = self.normalize_depth(depth)
         
-        depth = depth.cpu().numpy()
+        raw = None
+        if self.raw_format:
+            raw = depth.cpu().numpy().astype(self.raw_dtype, copy=False)
+        return depth_norm.cpu().numpy(), raw
+    
+    def predict(self, batch, output_size):
+        """Forward pass plus bicubic resize; returns raw float depth [B, H, W]"""
+        depth = self.midas(batch)
         
-        # Normalize to 0-255
-        depth_min = depth.min()
-        depth_max = depth.max()
-        depth_norm = ((depth - depth_min) / (depth_max - depth_min) * 255).astype(np.uint8)
+        # Resize to original size
+        return torch.nn.functional.interpolate(
+            depth.unsqueeze(1),
+            size=output_size,
+            mode="bicubic",
+            align_corners=False,
+        ).squeeze(1)
+    
+    def tile_positions(self, length):
+        """Start offsets of overlapping tiles covering [0, length)"""
+        if self.tile_overlap >= self.tile_size:
+            # The stride would be zero or negative and range() would never advance
+            raise ValueError(f"tile_overlap ({self.tile_overlap}) must be smaller than tile_size ({self.tile_size})")
+        if length <= self.tile_size:
+            return [0]
+        stride = self.tile_size - self.tile_overlap
+        positions = list(range(0, length - self.tile_size, stride))
+        # Last tile sits flush with the edge instead of hanging over it
+        positions.append(length - self.tile_size)
+        return positions
+    
+    def tile_weights(self, height, width):
+        """Linear ramps over the overlap so neighbouring tiles cross-fade"""
+        ramp = lambda n: np.minimum(1.0, np.minimum(np.arange(1, n + 1), np.arange(n, 0, -1))
+                                    / (self.tile_overlap + 1))
+        return np.outer(ramp(height), ramp(width)).astype(np.float32)
+    
+    def predict_tile(self, img_np, y, x, reference):
+        """
+        Depth for one tile, aligned to the whole-image prediction with a
+        least-squares scale and shift (MiDaS depth is only defined up to both).
+        """
+        tile = img_np[y:y + self.tile_size, x:x + self.tile_size]
+        input_tensor = self.transform(tile)
+        if input_tensor.dim() == 5:
+            input_tensor = input_tensor.squeeze(1)
         
-        # Save
+        with torch.no_grad():
+            depth = self.predict(input_tensor, tile.shape[:2])[0].cpu().numpy()
+        
+        target = reference[y:y + tile.shape[0], x:x + tile.shape[1]]
+        depth_mean, target_mean = depth.mean(), target.mean()
+        variance = ((depth - depth_mean) ** 2).mean()
+        if variance > 1e-12:
+            scale = ((depth - depth_mean) * (target - target_mean)).mean() / variance
+        else:
+            scale = 0.0
+        shift = target_mean - scale * depth_mean
+        return y, x, (depth * scale + shift).astype(np.float32)
+    
+    def generate_depth_map_tiled(self, image_path, output_path, store=None, loaded=None):
+        """
+        High-resolution depth for large photos.
+        A whole-image pass gives the global layout; overlapping tiles run at
+        the model's native resolution add detail and are blended into one
+        full-size map. At most 2 x tile_workers tiles are in memory at once.
+        """
+        print(f"📸 Processing (tiled): {os.path.basename(image_path)}")
+        
+        img_np, input_tensor = loaded if loaded is not None else self.load_image(image_path)
+        height, width = img_np.shape[:2]
+        
+        with torch.no_grad():
+            reference = self.predict(input_tensor, (height, width))[0].cpu().numpy()
+        
+        tiles = [(y, x) for y in self.tile_positions(height) for x in self.tile_positions(width)]
+        print(f"   🧩 {len(tiles)} tiles of {self.tile_size}px on {self.tile_workers} workers")
+        
+        depth_sum = np.zeros((height, width), dtype=np.float32)
+        weight_sum = np.zeros((height, width), dtype=np.float32)
+        
+        def blend(y, x, depth):
+            weights = self.tile_weights(*depth.shape)
+            depth_sum[y:y + depth.shape[0], x:x + depth.shape[1]] += depth * weights
+            weight_sum[y:y + depth.shape[0], x:x + depth.shape[1]] += weights
+        
+        with ThreadPoolExecutor(max_workers=self.tile_workers) as pool:
+            pending = set()
+            for y, x in tiles:
+                pending.add(pool.submit(self.predict_tile, img_np, y, x, reference))
+                if len(pending) >= 2 * self.tile_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        blend(*future.result())
+            for future in pending:
+                blend(*future.result())
+        
+        depth = torch.from_numpy(depth_sum / weight_sum)
+        depth_norm = self.normalize_depth(depth.unsqueeze(0))[0].numpy()
+        raw = depth.numpy().astype(self.raw_dtype, copy=False) if self.raw_format else None
+        
+        self.save_depth_map(depth_norm, output_path, raw, store)
+        return depth_norm
+    
+    def save_depth_map(self, depth_norm, output_path, raw=None, store=None):
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
         Image.fromarray(depth_norm).save(output_path)
+        
+        if raw is not None:
+            name = os.path.basename(output_path)[:-len("_depth.png")]
+            if self.raw_format == 'store':
+                if store is None:
+                    store = DepthStore(os.path.dirname(output_path))
+                store.put(name, raw)
+            else:
+                np.save(os.path.join(os.path.dirname(output_path), f"{name}_depth.npy"), raw)
+        
         print(f"💾 Saved: {os.path.basename(output_path)}")
+    
+    def generate_depth_map(self, image_path, output_path):
+        """
+        Generate depth map from an image
+        """
+        print(f"📸 Processing: {os.path.basename(image_path)}")
+        
+        img_np, input_tensor = self.load_image(image_path)
+        
+        # Generate depth map
+        depth_norm, raw = self.infer_batch([input_tensor], img_np.shape[:2])
+        depth_norm = depth_norm[0]
+        
+        # Save
+        self.save_depth_map(depth_norm, output_path, raw[0] if raw is not None else None)
         
         return depth_norm
     
-    def process_folder(self, input_folder, output_folder):
-        """Process all images in a folder"""
+    def generate_depth_maps(self, loaded, output_paths, pool=None, store=None):
+        """
+        Generate depth maps for a batch of already loaded images.
+        Images are grouped by transformed resolution so each group runs as a
+        single forward pass; within a group, images of the same original size
+        share one upsample and normalization call.
+        """
+        groups = {}
+        for (img_np, input_tensor), output_path in zip(loaded, output_paths):
+            key = (tuple(input_tensor.shape[-2:]), img_np.shape[:2])
+            groups.setdefault(key, []).append((input_tensor, output_path))
+        
+        saves = []
+        for (input_size, output_size), items in groups.items():
+            print(f"   🧮 Batch of {len(items)} at {input_size[1]}x{input_size[0]}")
+            depth_maps, raw_maps = self.infer_batch([t for t, _ in items], output_size)
+            
+            for j, (depth_norm, (_, output_path)) in enumerate(zip(depth_maps, items)):
+                raw = raw_maps[j] if raw_maps is not None else None
+                if pool is not None:
+                    saves.append(pool.submit(self.save_depth_map, depth_norm, output_path, raw, store))
+                else:
+                    self.save_depth_map(depth_norm, output_path, raw, store)
+        
+        for future in saves:
+            future.result()
+    
+    def process_folder(self, input_folder, output_folder, batch_size=8, num_workers=4, use_cache=True,
+                       decoded=None):
+        """
+        Process all images in a folder.
+        Images are decoded on a thread pool while the previous batch is
+        running through the model. batch_size=1 keeps the old one-by-one mode.
+        With use_cache, images whose content and settings match the manifest
+        are skipped.
+        decoded (utils.decoded_images.DecodedImages) supplies pixels that were
+        already decoded for the whole pipeline; only the transform runs here.
+        """
         
         # Create output folder
         os.makedirs(output_folder, exist_ok=True)
         
         # Get all images
-        images = [f for f in os.listdir(input_folder) 
-                 if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+        if decoded is not None:
+            images = decoded.names
+            load = lambda f: self.prepare_image(decoded.get(f))
+        else:
+            images = [f for f in os.listdir(input_folder) 
+                     if f.lower().endswith(IMAGE_EXTENSIONS)]
+            load = lambda f: self.load_image(os.path.join(input_folder, f))
         
         print(f"\n📁 Found {len(images)} images to process")
         
-        for i, img_file in enumerate(images, 1):
-            input_path = os.path.join(input_folder, img_file)
+        cache = DepthCache(output_folder, self.settings, self.raw_format) if use_cache else None
+        keys = {}
+        if cache is not None:
+            todo = []
+            for img_file in images:
+                output_path = os.path.join(output_folder, f"{os.path.splitext(img_file)[0]}_depth.png")
+                keys[img_file] = cache.key(os.path.join(input_folder, img_file))
+                # Copying a cached result for renamed images only covers the PNG
+                if not cache.lookup(img_file, keys[img_file], output_path,
+                                    allow_copy=self.raw_format is None):
+                    todo.append(img_file)
             
-            # Create output filename
-            name = os.path.splitext(img_file)[0]
-            output_path = os.path.join(output_folder, f"{name}_depth.png")
+            print(f"♻️  {len(images) - len(todo)} unchanged (cached), {len(todo)} to process")
+            cache.save()
+            images = todo
+        
+        batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+        store = DepthStore(output_folder) if self.raw_format == 'store' else None
+        
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            def prefetch(batch):
+                return [pool.submit(load, f) for f in batch]
             
-            print(f"\n[{i}/{len(images)}] Processing...")
-            self.generate_depth_map(input_path, output_path)
+            pending = prefetch(batches[0]) if batches else []
+            
+            for i, batch in enumerate(batches):
+                loaded = [future.result() for future in pending]
+                
+                # Start decoding the next batch before running this one
+                if i + 1 < len(batches):
+                    pending = prefetch(batches[i + 1])
+                
+                # Create output filenames
+                output_paths = [
+                    os.path.join(output_folder, f"{os.path.splitext(f)[0]}_depth.png")
+                    for f in batch
+                ]
+                
+                print(f"\n[{i + 1}/{len(batches)}] Processing {len(batch)} images...")
+                
+                # Images bigger than one tile go through the tiled path one at a time
+                batched = []
+                for img_file, item, output_path in zip(batch, loaded, output_paths):
+                    if self.tile_size and max(item[0].shape[:2]) > self.tile_size:
+                        self.generate_depth_map_tiled(
+                            os.path.join(input_folder, img_file), output_path, store, item
+                        )
+                    else:
+                        batched.append((item, output_path))
+                
+                if batched:
+                    self.generate_depth_maps(
+                        [item for item, _ in batched], [path for _, path in batched], pool, store
+                    )
+                
+                # Record finished batches right away so an interrupted run keeps its progress
+                if cache is not None:
+                    for img_file, output_path in zip(batch, output_paths):
+                        cache.update(img_file, keys[img_file], output_path)
+                    cache.save()
+        
+        if store is not None:
+            # Depth maps re-rendered at a new size were appended; drop the old copies
+            freed = store.compact()
+            if freed:
+                print(f"🗜️  Depth store compacted, {freed / 1e6:.1f} MB freed")
         
         print(f"\n✅ Done! Depth maps saved in: {output_folder}")
 
@@ -108,7 +471,7 @@ def main():
     
     # Check if there are images
     images = [f for f in os.listdir(input_folder) 
-             if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+             if f.lower().endswith(IMAGE_EXTENSIONS)]
     print(f"📸 Found {len(images)} images in input folder")
     
     # Create generator
@@ -119,8 +482,8 @@ def main():
     
     # Check if output was created
     if os.path.exists(output_folder):
-        output_files = os.listdir(output_folder)
-        print(f"\n✅ Member 1 task completed! {len(output_files)} depth maps created")
+        output_files = [f for f in os.listdir(output_folder) if f.endswith('_depth.png')]
+        print(f"\n✅ Member 1 task completed! {len(output_files)} depth maps available")
     else:
         print("\n❌ No output files were created")
 
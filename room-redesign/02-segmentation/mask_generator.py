@@ -4,115 +4,216 @@ Takes room images and generates individual object masks
 """
 
 import os
+import sys
 import torch
+import torch.nn.functional as F
 import numpy as np
 from PIL import Image
 import matplotlib.pyplot as plt
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import ade20k, model_store
+from utils.label_maps import save_label_map
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
 
 class MaskGenerator:
-    def __init__(self):
-        """Initialize the segmentation model"""
+    # Selectable per run; the MobileNet variants are much lighter on CPU
+    BACKBONES = {
+        'resnet50': 'deeplabv3_resnet50',
+        'mobilenet_v3_large': 'deeplabv3_mobilenet_v3_large',
+        'lraspp_mobilenet_v3_large': 'lraspp_mobilenet_v3_large',
+    }
+    
+    # Set when the label map colors follow a fixed, model-meaningful palette
+    PALETTE_NAME = None
+    
+    # Model output channel of label id n is n - CHANNEL_OFFSET
+    CHANNEL_OFFSET = 0
+    
+    def __init__(self, model_dir=None, backbone='resnet50', max_side=520):
+        """
+        Initialize the segmentation model.
+        Uses the local model store when it has been exported
+        (python -m utils.model_store export), otherwise torch.hub.
+        
+        max_side caps the longer image side fed to the model (None = native
+        resolution); labels are upsampled back with nearest neighbour.
+        """
         print("🔄 Initializing Mask Generator...")
-        print("   This will download the segmentation model (first time only)...")
         
-        # Load a pre-trained segmentation model (DeepLabV3)
-        self.model = torch.hub.load('pytorch/vision:v0.10.0', 'deeplabv3_resnet50', pretrained=True)
-        self.model.eval()
+        if backbone not in self.BACKBONES:
+            raise ValueError(f"backbone must be one of {list(self.BACKBONES)}")
         
-        # ImageNet normalization
+        model_name = self.BACKBONES[backbone]
+        print(f"   Model: {model_name}, max side: {max_side or 'native'}")
+        if model_store.has_segmentation_model(model_name, model_dir):
+            # Offline: stored weights, memory-mapped into torchvision's model
+            print("   Loading segmentation model from local model store...")
+            self.model = model_store.load_segmentation_model(model_name, model_dir)
+        else:
+            print("   This will download the segmentation model (first time only)...")
+            
+            # Load a pre-trained segmentation model (DeepLabV3 / LR-ASPP)
+            self.model = torch.hub.load('pytorch/vision:v0.10.0', model_name, pretrained=True)
+            self.model.eval()
+        
+        # Pascal VOC class labels (torchvision's pretrained segmentation
+        # heads predict these 21 classes), spelled the COCO way
+        classes = [
+            '__background__', 'airplane', 'bicycle', 'bird', 'boat', 'bottle', 'bus',
+            'car', 'cat', 'chair', 'cow', 'dining table', 'dog', 'horse', 'motorcycle',
+            'person', 'potted plant', 'sheep', 'couch', 'train', 'tv'
+        ]
+        
+        # Room-relevant classes we care about
+        room_classes = {
+            9: 'chair',
+            11: 'dining table',
+            16: 'potted plant',
+            18: 'couch',
+            20: 'tv'
+        }
+        
+        self._setup(max_side, classes, room_classes)
+        print(f"✅ Mask Generator initialized with {len(self.classes)} classes")
+    
+    def _setup(self, max_side, classes, room_classes):
+        """Input transform, class lists and output settings shared by every model"""
+        self.max_side = max_side
+        
+        # ImageNet normalization (also what the ADE20K image processors use)
         from torchvision import transforms
         self.transform = transforms.Compose([
             transforms.ToTensor(),
             transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
         ])
         
-        # COCO class labels (the model was trained on COCO dataset)
-        self.classes = [
-            '__background__', 'person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus',
-            'train', 'truck', 'boat', 'traffic light', 'fire hydrant', 'stop sign',
-            'parking meter', 'bench', 'bird', 'cat', 'dog', 'horse', 'sheep', 'cow',
-            'elephant', 'bear', 'zebra', 'giraffe', 'backpack', 'umbrella', 'handbag',
-            'tie', 'suitcase', 'frisbee', 'skis', 'snowboard', 'sports ball', 'kite',
-            'baseball bat', 'baseball glove', 'skateboard', 'surfboard', 'tennis racket',
-            'bottle', 'wine glass', 'cup', 'fork', 'knife', 'spoon', 'bowl', 'banana',
-            'apple', 'sandwich', 'orange', 'broccoli', 'carrot', 'hot dog', 'pizza',
-            'donut', 'cake', 'chair', 'couch', 'potted plant', 'bed', 'dining table',
-            'toilet', 'tv', 'laptop', 'mouse', 'remote', 'keyboard', 'cell phone',
-            'microwave', 'oven', 'toaster', 'sink', 'refrigerator', 'book', 'clock',
-            'vase', 'scissors', 'teddy bear', 'hair drier', 'toothbrush'
-        ]
+        self.classes = classes
+        self.room_classes = room_classes
         
-        # Room-relevant classes we care about
-        self.room_classes = {
-            57: 'chair',
-            58: 'couch',
-            59: 'potted plant',
-            60: 'bed',
-            61: 'dining table',
-            62: 'toilet',
-            63: 'tv',
-            72: 'sink',
-            73: 'refrigerator'
-        }
+        # Everything else is excluded before the argmax
+        self.ignored_ids = [obj_id - self.CHANNEL_OFFSET for obj_id in range(1, len(classes))
+                            if obj_id not in room_classes]
         
-        print(f"✅ Mask Generator initialized with {len(self.classes)} classes")
+        # Smallest object worth a mask, in pixels
+        self.min_mask_pixels = 500
+        
+        # Output is one label map + JSON sidecar per image (utils/label_maps.py).
+        # Set to True to also write the old per-class PNGs and colored map.
+        self.legacy_outputs = False
         
     def generate_masks(self, image_path, output_folder):
         """
-        Generate individual masks for each object in the image
+        Generate the label map for a single image.
+        Returns the names of classes large enough to count as objects.
         """
         print(f"📸 Processing: {os.path.basename(image_path)}")
         
-        # Load and prepare image
-        img = Image.open(image_path).convert('RGB')
-        img_tensor = self.transform(img).unsqueeze(0)
+        original_size, img_tensor = self.load_image(image_path)
+        predictions = self.predict(img_tensor.unsqueeze(0))[0]
         
-        # Generate segmentation
-        with torch.no_grad():
-            output = self.model(img_tensor)['out'][0]
-            predictions = output.argmax(0).cpu().numpy()
+        img_name = os.path.splitext(os.path.basename(image_path))[0]
+        return self.save_masks(self.upsample_labels(predictions, original_size), img_name, output_folder)
+    
+    def load_image(self, image_path):
+        """
+        Decode an image, shrink it to max_side, and normalize it.
+        Returns the original (width, height) and a [3, H, W] tensor.
+        """
+        return self._prepare(Image.open(image_path).convert('RGB'))
+    
+    def prepare_image(self, img_np):
+        """Same as load_image for an already decoded [H, W, 3] RGB array"""
+        return self._prepare(Image.fromarray(img_np))
+    
+    def _prepare(self, img):
+        original_size = img.size
         
+        if self.max_side and max(img.size) > self.max_side:
+            scale = self.max_side / max(img.size)
+            img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                             Image.BILINEAR)
+        
+        return original_size, self.transform(img)
+    
+    def predict(self, batch):
+        """Segment a [B, 3, H, W] batch; returns [B, H, W] uint8 class ids"""
+        with torch.no_grad():
+            output = self.model(batch)['out']
+            # Only background and room classes can win
+            output[:, self.ignored_ids] = float('-inf')
+            # Fewer than 256 classes, so uint8 labels are enough
+            return output.argmax(1).to(torch.uint8).cpu().numpy()
+    
+    def upsample_labels(self, predictions, original_size):
+        """Nearest-neighbour resize of a label map back to (width, height)"""
+        if (predictions.shape[1], predictions.shape[0]) == tuple(original_size):
+            return predictions
+        return np.array(Image.fromarray(predictions).resize(original_size, Image.NEAREST))
+    
+    def save_masks(self, predictions, img_name, output_folder):
+        """
+        Write the label map (and legacy outputs) for a full-size prediction.
+        Returns the names of classes large enough to count as objects.
+        """
         # Create output folder for this image
-        img_name = os.path.splitext(os.path.basename(image_path))[0]
         img_output_folder = os.path.join(output_folder, img_name)
         os.makedirs(img_output_folder, exist_ok=True)
         
-        # Get unique object IDs found in the image
-        unique_ids = np.unique(predictions)
+        # One pass over the label map gives every class's pixel count
+        counts = np.bincount(predictions.ravel(), minlength=len(self.classes))
+        present_ids = np.flatnonzero(counts)
         
-        # Create individual masks for each object
-        masks_created = []
+        # Classes large enough to count as objects (filter noise)
+        mask_ids = [obj_id for obj_id in present_ids
+                    if obj_id != 0 and counts[obj_id] > self.min_mask_pixels]
+        masks_created = [self.classes[obj_id] if obj_id < len(self.classes) else 'unknown'
+                         for obj_id in mask_ids]
         
-        for obj_id in unique_ids:
-            if obj_id == 0:  # Skip background
-                continue
-                
-            class_name = self.classes[obj_id] if obj_id < len(self.classes) else 'unknown'
-            
-            # Create binary mask for this object
-            mask = (predictions == obj_id).astype(np.uint8) * 255
-            
-            # Only save if mask has enough pixels (filter noise)
-            if np.sum(mask) > 500:  # Minimum 500 white pixels
-                mask_img = Image.fromarray(mask)
-                mask_filename = f"{class_name}_mask_{obj_id}.png"
-                mask_path = os.path.join(img_output_folder, mask_filename)
-                mask_img.save(mask_path)
-                masks_created.append(class_name)
-                print(f"  ✅ Created mask: {class_name}")
-        
-        # Also create a combined color-coded segmentation map
-        self.create_colored_segmentation(predictions, img_output_folder, img_name)
+        # One indexed PNG holds every class; its palette doubles as the colored map
+        save_label_map(predictions, img_output_folder, img_name, self.classes, counts,
+                       self.min_mask_pixels, self.segmentation_colors(present_ids),
+                       palette_name=self.PALETTE_NAME)
+        for class_name, obj_id in zip(masks_created, mask_ids):
+            print(f"  ✅ Found: {class_name} ({counts[obj_id]} px)")
+        print("  ✅ Created label map")
+        
+        if self.legacy_outputs:
+            self.write_binary_masks(predictions, mask_ids, masks_created, img_output_folder)
+            self.create_colored_segmentation(predictions, img_output_folder, img_name, present_ids)
         
         print(f"  ✅ Total {len(masks_created)} masks created for {img_name}")
         return masks_created
     
-    def create_colored_segmentation(self, predictions, output_folder, img_name):
+    def write_binary_masks(self, predictions, mask_ids, class_names, output_folder):
         """
-        Create a color-coded segmentation map for visualization
+        Write one {class}_mask_{id}.png per object (legacy format)
+        """
+        # A single palette image backs every mask file: only the palette
+        # changes per class, so no per-class image is ever allocated
+        label_img = Image.fromarray(predictions)
+        
+        for obj_id, class_name in zip(mask_ids, class_names):
+            # Palette maps this class to white and everything else to
+            # black, so the file reads as a 0/255 mask with convert('L')
+            palette = [0] * 768
+            palette[obj_id * 3:obj_id * 3 + 3] = [255, 255, 255]
+            label_img.putpalette(palette)
+            
+            mask_filename = f"{class_name}_mask_{obj_id}.png"
+            label_img.save(os.path.join(output_folder, mask_filename))
+            print(f"  ✅ Created mask: {class_name}")
+    
+    def segmentation_colors(self, present_ids):
+        """
+        Lookup table from class id to display color; background stays black
         """
         # Create a color map
-        colors = [
+        colors = np.array([
             [0, 0, 0],       # 0: background (black)
             [255, 0, 0],     # 1: red
             [0, 255, 0],     # 2: green
@@ -126,30 +227,40 @@ class MaskGenerator:
             [128, 128, 0],   # 10: olive
             [128, 0, 128],   # 11: purple
             [0, 128, 128],   # 12: teal
-        ]
-        
-        # Create RGB image
-        h, w = predictions.shape
-        rgb_image = np.zeros((h, w, 3), dtype=np.uint8)
+        ], dtype=np.uint8)
         
+        lut = np.zeros((256, 3), dtype=np.uint8)
+        for i, obj_id in enumerate(present_ids):
+            if obj_id == 0:
+                continue
+            lut[obj_id] = colors[(i % (len(colors) - 1)) + 1]  # Skip index 0 (background)
+        return lut
+    
+    def create_colored_segmentation(self, predictions, output_folder, img_name, present_ids=None):
+        """
+        Create a color-coded segmentation map for visualization
+        """
         # Get unique objects
-        unique_ids = np.unique(predictions)
+        if present_ids is None:
+            present_ids = np.flatnonzero(np.bincount(predictions.ravel()))
         
-        for i, obj_id in enumerate(unique_ids):
-            if obj_id == 0:  # Background black
-                continue
-            color_idx = (i % (len(colors) - 1)) + 1  # Skip index 0 (background)
-            mask = (predictions == obj_id)
-            rgb_image[mask] = colors[color_idx]
+        lut = self.segmentation_colors(present_ids)
+        
+        # Colorize the whole map in one indexing operation
+        rgb_image = lut[predictions]
         
         # Save
         output_path = os.path.join(output_folder, f"{img_name}_segmentation_colored.png")
         Image.fromarray(rgb_image).save(output_path)
         print(f"  ✅ Created colored segmentation map")
     
-    def process_folder(self, input_folder, output_folder):
+    def process_folder(self, input_folder, output_folder, batch_size=4, num_workers=4, decoded=None):
         """
-        Process all images in a folder
+        Process all images in a folder.
+        Images are decoded and resized on a thread pool ahead of the model;
+        every batch_size images, those that end up the same size run as one batch.
+        decoded (utils.decoded_images.DecodedImages) supplies pixels that were
+        already decoded for the whole pipeline.
         """
         print(f"\n📁 Processing batch from: {input_folder}")
         
@@ -157,24 +268,51 @@ class MaskGenerator:
         os.makedirs(output_folder, exist_ok=True)
         
         # Get all images
-        images = [f for f in os.listdir(input_folder) 
-                 if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+        if decoded is not None:
+            images = decoded.names
+            load = lambda f: self.prepare_image(decoded.get(f))
+        else:
+            images = [f for f in os.listdir(input_folder) 
+                     if f.lower().endswith(IMAGE_EXTENSIONS)]
+            load = lambda f: self.load_image(os.path.join(input_folder, f))
         
         print(f"Found {len(images)} images to process")
         
         all_masks = {}
         
-        for i, img_file in enumerate(images, 1):
-            input_path = os.path.join(input_folder, img_file)
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            # Prefetch: keep about two batches decoding ahead of the model
+            pending = deque()
+            queue = iter(images)
+            for img_file in islice(queue, 2 * batch_size):
+                pending.append((img_file, pool.submit(load, img_file)))
             
-            print(f"\n[{i}/{len(images)}] Processing {img_file}...")
+            # Group by model input size so each group can run as one batch;
+            # like the depth stage, at most batch_size images are held at once
+            groups = {}
+            queued = 0
+            while pending:
+                img_file, future = pending.popleft()
+                for next_file in islice(queue, 1):
+                    pending.append((next_file, pool.submit(load, next_file)))
+                try:
+                    original_size, img_tensor = future.result()
+                except Exception as e:
+                    print(f"❌ Error loading {img_file}: {e}")
+                    continue
+                
+                key = tuple(img_tensor.shape[-2:])
+                groups.setdefault(key, []).append((img_file, original_size, img_tensor))
+                queued += 1
+                
+                if queued >= batch_size:
+                    for batch in groups.values():
+                        self._run_batch(batch, output_folder, all_masks, pool)
+                    groups = {}
+                    queued = 0
             
-            try:
-                masks = self.generate_masks(input_path, output_folder)
-                all_masks[img_file] = masks
-                print(f"✅ Completed")
-            except Exception as e:
-                print(f"❌ Error: {e}")
+            for batch in groups.values():
+                self._run_batch(batch, output_folder, all_masks, pool)
         
         # Save mask summary
         summary_path = os.path.join(output_folder, "mask_summary.txt")
@@ -190,6 +328,80 @@ class MaskGenerator:
         print(f"📁 Masks saved in: {output_folder}")
         print(f"📄 Summary saved: {summary_path}")
 
+    def _run_batch(self, batch, output_folder, all_masks, pool):
+        names = ", ".join(img_file for img_file, _, _ in batch)
+        print(f"\n🧮 Segmenting {len(batch)} image(s): {names}")
+        
+        try:
+            predictions = self.predict(torch.stack([t for _, _, t in batch]))
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            return
+        
+        # Upsampling and PNG encoding run on the pool while the next batch loads
+        saves = {
+            img_file: pool.submit(
+                self.save_masks,
+                self.upsample_labels(labels, original_size),
+                os.path.splitext(img_file)[0],
+                output_folder,
+            )
+            for (img_file, original_size, _), labels in zip(batch, predictions)
+        }
+        for img_file, future in saves.items():
+            try:
+                all_masks[img_file] = future.result()
+                print(f"✅ Completed {img_file}")
+            except Exception as e:
+                print(f"❌ Error: {e}")
+
+class ADE20KMaskGenerator(MaskGenerator):
+    """
+    ADE20K segmentation (Segformer / UperNet via transformers) limited to
+    indoor classes. The label map is drawn with the palette sd-controlnet-seg
+    was trained on, so it is the segmentation conditioning image as written.
+    """
+    
+    MODELS = list(model_store.ADE20K_MODELS)
+    PALETTE_NAME = 'ade20k'
+    
+    # Label 0 is "other"; the model's 150 channels are ADE20K classes 1..150
+    CHANNEL_OFFSET = 1
+    
+    def __init__(self, model_dir=None, model_name='segformer-b0', max_side=512):
+        print("🔄 Initializing ADE20K Mask Generator...")
+        
+        if model_name not in model_store.ADE20K_MODELS:
+            raise ValueError(f"model_name must be one of {self.MODELS}")
+        
+        print(f"   Model: {model_name}, max side: {max_side or 'native'}")
+        self.model = model_store.load_ade20k_model(model_name, model_dir)
+        
+        room_classes = {obj_id: ade20k.CLASSES[obj_id] for obj_id in ade20k.INDOOR_IDS}
+        self._setup(max_side, ade20k.CLASSES, room_classes)
+        
+        print(f"✅ Mask Generator initialized with {len(self.room_classes)} indoor classes")
+    
+    def predict(self, batch):
+        """Segment a [B, 3, H, W] batch; returns [B, H, W] uint8 ADE20K label ids"""
+        with torch.no_grad():
+            logits = self.model(pixel_values=batch).logits
+            
+            # Logits come out at 1/4 resolution; upsample one image at a
+            # time so the batch never holds 150 full-size channels at once
+            labels = []
+            for image_logits in logits:
+                image_logits = F.interpolate(image_logits.unsqueeze(0), size=batch.shape[-2:],
+                                             mode='bilinear', align_corners=False)[0]
+                # Masked after upsampling: interpolating -inf would give NaN
+                image_logits[self.ignored_ids] = float('-inf')
+                labels.append(image_logits.argmax(0) + 1)
+            return torch.stack(labels).to(torch.uint8).cpu().numpy()
+    
+    def segmentation_colors(self, present_ids):
+        """Fixed ADE20K palette, whatever classes are present"""
+        return ade20k.palette_lut()
+
 def main():
     print("=" * 50)
     print("MEMBER 2: Segmentation Mask Generator")
@@ -204,8 +416,15 @@ def main():
         print(f"❌ Input folder not found: {input_folder}")
         return
     
+    # Model per run: an ADE20K model (default, ControlNet-ready label maps)
+    # or a VOC backbone, e.g. `python mask_generator.py mobilenet_v3_large`
+    model_name = sys.argv[1] if len(sys.argv) > 1 else 'segformer-b0'
+    
     # Create generator
-    generator = MaskGenerator()
+    if model_name in ADE20KMaskGenerator.MODELS:
+        generator = ADE20KMaskGenerator(model_name=model_name)
+    else:
+        generator = MaskGenerator(backbone=model_name)
     
     # Process all images
     generator.process_folder(input_folder, output_folder)
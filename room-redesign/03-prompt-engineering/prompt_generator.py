@@ -152,18 +152,19 @@ class PromptGenerator:
         
         return prompts
     
-    def process_images(self, input_folder, output_file):
-        """Generate prompts for all images"""
+    def process_images(self, input_folder, output_file, images=None):
+        """Generate prompts for all images (or the given image names)"""
         
         print(f"\n📁 Processing images from: {input_folder}")
         
         # Get all images
-        if not os.path.exists(input_folder):
-            print(f"❌ Input folder not found: {input_folder}")
-            return
-        
-        images = [f for f in os.listdir(input_folder) 
-                 if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+        if images is None:
+            if not os.path.exists(input_folder):
+                print(f"❌ Input folder not found: {input_folder}")
+                return
+            
+            images = [f for f in os.listdir(input_folder) 
+                     if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
         
         print(f"Found {len(images)} images")
         
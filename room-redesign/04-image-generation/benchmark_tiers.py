@@ -0,0 +1,150 @@
+"""
+Latency tier benchmark
+Renders the same rooms, styles and seeds at every ImageGenerator tier and
+reports seconds per image (and, with the CPU profile, ms per denoising step
+and peak RSS) next to how far each tier drifts from the 'quality' tier
+(PSNR and SSIM against its image), to pick a tier per job.
+
+Run from the 04-image-generation folder:
+    python benchmark_tiers.py [max_rooms] [styles_per_room]
+"""
+
+import os
+import sys
+import json
+import time
+import torch
+import numpy as np
+import cv2
+
+from image_generator import ImageGenerator
+from utils import cpu_perf
+
+REFERENCE_TIER = 'quality'
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def ssim(a, b):
+    """Mean SSIM of the grayscale images (Gaussian window, sigma 1.5)"""
+    a = cv2.cvtColor(a, cv2.COLOR_RGB2GRAY).astype(np.float64)
+    b = cv2.cvtColor(b, cv2.COLOR_RGB2GRAY).astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    blur = lambda x: cv2.GaussianBlur(x, (11, 11), 1.5)
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a * a) - mu_a ** 2
+    var_b = blur(b * b) - mu_b ** 2
+    cov = blur(a * b) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim_map.mean())
+
+
+def run_benchmark(generator, prompts_file, depth_folder, masks_folder, output_folder,
+                  tiers=None, max_rooms=3, styles_per_room=2, seed=1234):
+    with open(prompts_file, 'r') as f:
+        all_prompts = json.load(f)
+
+    # Reference tier first, so every other tier can be compared as it finishes
+    tiers = tiers or list(ImageGenerator.TIERS)
+    tiers = [REFERENCE_TIER] + [t for t in tiers if t != REFERENCE_TIER]
+
+    rooms = []
+    for image_name, prompts in list(all_prompts.items())[:max_rooms]:
+        selected = dict(list(prompts.items())[:styles_per_room])
+        rooms.append(generator.style_jobs(image_name, selected, depth_folder, masks_folder, output_folder))
+
+    results = {}
+    references = {}
+
+    for tier in tiers:
+        tier_folder = os.path.join(output_folder, tier)
+        os.makedirs(tier_folder, exist_ok=True)
+        steps, guidance_scale = generator.use_tier(tier)
+        print(f"\n⚡ Tier: {tier} ({steps} steps, guidance {guidance_scale})")
+
+        seconds, step_ms, psnrs, ssims = [], [], [], []
+        for jobs in rooms:
+            output_paths = [os.path.join(tier_folder, os.path.basename(job["output_path"])) for job in jobs]
+
+            # Same seed per sample in every tier, so only the sampler differs
+            generators = [torch.Generator(device="cpu").manual_seed(seed) for _ in jobs]
+
+            start_time = time.time()
+            images = generator.generate_images(
+                [job["prompt"] for job in jobs],
+                [job["negative_prompt"] for job in jobs],
+                [jobs[0]["depth_image"]],
+                [jobs[0]["seg_image"]],
+                output_paths,
+                num_inference_steps=steps,
+                guidance_scale=guidance_scale,
+                generator=generators,
+            )
+            seconds.append((time.time() - start_time) / len(jobs))
+            if generator.step_timer is not None:
+                step_ms.append(generator.step_timer.mean_ms())
+
+            for job, image in zip(jobs, images):
+                pixels = np.array(image.convert('RGB'))
+                key = os.path.basename(job["output_path"])
+                if tier == REFERENCE_TIER:
+                    references[key] = pixels
+                else:
+                    psnrs.append(psnr(references[key], pixels))
+                    ssims.append(ssim(references[key], pixels))
+
+        results[tier] = {
+            **ImageGenerator.TIERS[tier],
+            "seconds_per_image": round(float(np.mean(seconds)), 2),
+            "ms_per_step": round(float(np.mean(step_ms))) if step_ms else None,
+            "peak_rss_mb": round(cpu_perf.peak_rss_mb()),
+            "psnr_vs_quality": round(float(np.mean(psnrs)), 2) if psnrs else None,
+            "ssim_vs_quality": round(float(np.mean(ssims)), 4) if ssims else None,
+        }
+
+    # Save and show the table
+    report_path = os.path.join(output_folder, "tier_benchmark.json")
+    with open(report_path, 'w') as f:
+        json.dump({"seed": seed, "rooms": len(rooms), "tiers": results}, f, indent=2)
+
+    print("\n" + "=" * 60)
+    print(f"{'Tier':<10}{'Sampler':<8}{'Steps':>6}{'s/image':>10}{'ms/step':>9}{'PSNR':>8}{'SSIM':>8}")
+    for tier, r in results.items():
+        print(f"{tier:<10}{r['scheduler']:<8}{r['steps']:>6}{r['seconds_per_image']:>10}"
+              f"{r['ms_per_step'] or '-':>9}{r['psnr_vs_quality'] or '-':>8}{r['ssim_vs_quality'] or '-':>8}")
+    print(f"Peak RSS: {cpu_perf.peak_rss_mb():.0f} MB")
+    print(f"\n📄 Report: {report_path}")
+    return results
+
+
+def main():
+    print("=" * 50)
+    print("Latency Tier Benchmark")
+    print("=" * 50)
+
+    # Paths
+    prompts_file = "../data/prompts/prompts.json"
+    depth_folder = "../data/depth_maps"
+    masks_folder = "../data/masks"
+    output_folder = "../data/outputs/benchmark"
+
+    if not os.path.exists(prompts_file):
+        print(f"❌ Prompts file not found: {prompts_file}")
+        return
+
+    max_rooms = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    styles_per_room = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+
+    generator = ImageGenerator()
+    if generator.pipe is None:
+        print("❌ Models not loaded, nothing to benchmark")
+        return
+
+    run_benchmark(generator, prompts_file, depth_folder, masks_folder, output_folder,
+                  max_rooms=max_rooms, styles_per_room=styles_per_room)
+
+if __name__ == "__main__":
+    main()
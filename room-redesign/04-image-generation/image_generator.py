@@ -4,55 +4,170 @@ Uses Stable Diffusion + ControlNet to generate redesigned rooms
 """
 
 import os
+import sys
 import json
 import torch
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageFilter
 import cv2
-from diffusers import StableDiffusionControlNetPipeline, ControlNetModel
+from diffusers import StableDiffusionControlNetPipeline, StableDiffusionControlNetInpaintPipeline, ControlNetModel
+from diffusers import (DPMSolverMultistepScheduler, LCMScheduler, PNDMScheduler,
+                       UniPCMultistepScheduler)
 from diffusers.utils import load_image
 import time
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.label_maps import LabelMap
+from utils.prompt_embeddings import PromptEmbeddingCache
+from utils.render_cache import RenderCache, image_hash, render_key
+from utils.job_queue import job_seed
+from utils.render_progress import PreviewCallback, RenderCancelled, chain_callbacks
+from utils import ade20k, cpu_perf, model_store
+
 class ImageGenerator:
-    def __init__(self):
-        """Initialize Stable Diffusion with ControlNet"""
+    SD_MODEL = "runwayml/stable-diffusion-v1-5"
+    CONTROLNET_DEPTH = "lllyasviel/sd-controlnet-depth"
+    CONTROLNET_SEG = "lllyasviel/sd-controlnet-seg"
+    
+    # Samplers selectable per job; PNDM is the SD 1.5 default
+    SCHEDULERS = {
+        'pndm': PNDMScheduler,
+        'dpm++': DPMSolverMultistepScheduler,
+        'unipc': UniPCMultistepScheduler,
+        'lcm': LCMScheduler,
+    }
+    
+    # Few-step mode: LCM-LoRA distilled for SD 1.5 (needs the peft package)
+    LCM_LORA = "latent-consistency/lcm-lora-sdv1-5"
+    
+    # Latency tiers, fastest first. 'quality' is the original 20-step setup;
+    # benchmark_tiers.py measures time and drift from it on our rooms.
+    TIERS = {
+        'draft': {'scheduler': 'lcm', 'steps': 4, 'guidance_scale': 1.0},
+        'fast': {'scheduler': 'unipc', 'steps': 10, 'guidance_scale': 7.5},
+        'standard': {'scheduler': 'dpm++', 'steps': 15, 'guidance_scale': 7.5},
+        'quality': {'scheduler': 'pndm', 'steps': 20, 'guidance_scale': 7.5},
+    }
+    
+    # Segmentation map colors for masks from the Pascal VOC models (RGB)
+    SEG_COLORS = {
+        'chair': (255, 0, 0),      # Red
+        'couch': (0, 255, 0),       # Green
+        'bed': (0, 0, 255),          # Blue
+        'dining table': (255, 255, 0),  # Yellow
+        'tv': (255, 0, 255),         # Magenta
+        'potted plant': (0, 255, 255),  # Cyan
+        'refrigerator': (128, 0, 0),  # Dark red
+        'sink': (0, 128, 0),         # Dark green
+        'train': (0, 0, 128),         # Dark blue
+        'boat': (128, 128, 0),        # Olive
+        'fire hydrant': (128, 0, 128), # Purple
+        'bird': (0, 128, 128),        # Teal
+    }
+    SEG_MAP_CACHE_SIZE = 32
+    
+    # Steps between latent previews when a render publishes progress
+    PREVIEW_EVERY = 5
+    
+    # Inpainting renders the mask's bounding box, long side scaled into this range
+    INPAINT_MIN_SIDE = 256
+    INPAINT_MAX_SIDE = 512
+    
+    # Off until a CPU profile is applied in __init__
+    bf16 = False
+    step_timer = None
+    
+    def __init__(self, tier='standard', cpu_profile=True, graph=None, num_threads=None,
+                 mmap_weights=False):
+        """
+        Initialize Stable Diffusion with ControlNet.
+        On CPU, cpu_profile applies utils/cpu_perf.py: thread tuning,
+        bfloat16 weights + autocast where the CPU supports it, channels-last,
+        sliced/tiled VAE decode, and graph optimization ('compile' or 'ipex').
+        mmap_weights points the weights at memory maps of their safetensors
+        files, so processes share one copy (see worker_pool.py).
+        """
         print("🔄 Initializing Image Generator...")
+        
+        if tier not in self.TIERS:
+            raise ValueError(f"tier must be one of {list(self.TIERS)}")
+        self.tier = tier
+        self.seg_maps = {}
+        self.inpaint_pipe = None
+        self.scheduler_name = None
+        self.lcm_loaded = False
         print("   This will download models (first time only, may take a while)...")
         
         # Check if we have CUDA (GPU) or fallback to CPU
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         print(f"   Using device: {self.device}")
         
+        self.cpu_profile = cpu_profile and self.device == "cpu"
+        if self.cpu_profile:
+            # Before loading: the inter-op pool can only be sized up front
+            threads = cpu_perf.tune_threads(num_threads)
+            self.bf16 = cpu_perf.bf16_supported()
+            print(f"   CPU profile: {threads} threads, bfloat16: {'yes' if self.bf16 else 'no (not supported)'}")
+        
+        # bfloat16 halves the resident weights where the CPU runs it natively
+        dtype = torch.bfloat16 if self.bf16 else torch.float32
+        
         try:
             # Load ControlNet models (smaller versions for CPU)
             print("   Loading ControlNet models...")
             
             # For depth control
             self.controlnet_depth = ControlNetModel.from_pretrained(
-                "lllyasviel/sd-controlnet-depth", 
-                torch_dtype=torch.float32
+                self.CONTROLNET_DEPTH, 
+                torch_dtype=dtype
             )
             
             # For segmentation control
             self.controlnet_seg = ControlNetModel.from_pretrained(
-                "lllyasviel/sd-controlnet-seg", 
-                torch_dtype=torch.float32
+                self.CONTROLNET_SEG, 
+                torch_dtype=dtype
             )
             
             # Load Stable Diffusion pipeline with both ControlNets
             print("   Loading Stable Diffusion (this may take 2-3 minutes)...")
             self.pipe = StableDiffusionControlNetPipeline.from_pretrained(
-                "runwayml/stable-diffusion-v1-5",
+                self.SD_MODEL,
                 controlnet=[self.controlnet_depth, self.controlnet_seg],
-                torch_dtype=torch.float32,
+                torch_dtype=dtype,
                 safety_checker=None  # Disable safety checker for speed
             )
             
             # Move to CPU (since we're on CPU)
             self.pipe = self.pipe.to(self.device)
             
-            # Enable memory optimizations
-            self.pipe.enable_attention_slicing()
+            mmap_weights = mmap_weights and self.device == "cpu"
+            if mmap_weights:
+                # Before the CPU profile: weights it converts become copies
+                self.map_weights()
+            
+            if self.cpu_profile:
+                # No attention slicing: it rules out PyTorch's fused attention,
+                # which is already memory-efficient on CPU
+                settings = cpu_perf.apply_cpu_profile(self.pipe, bf16=self.bf16, graph=graph)
+                self.step_timer = cpu_perf.StepTimer()
+                print(f"   CPU profile applied: {settings}")
+            else:
+                # Enable memory optimizations
+                self.pipe.enable_attention_slicing()
+            
+            if mmap_weights:
+                # Counted after the profile, which may have copied some of them
+                print(f"   Memory-mapped weights: {self.mapped_bytes() / 1024**3:.2f} GB")
+            
+            # Every scheduler is built from the model's own scheduler config
+            self.scheduler_config = self.pipe.scheduler.config
+            self.scheduler_name = 'pndm'
+            
+            # Prompts are encoded once and reused (memory + data/cache on disk)
+            self.prompt_cache = PromptEmbeddingCache.for_pipeline(self.pipe, self.SD_MODEL)
+            
+            # Seeded renders are kept in data/cache/renders and never run twice
+            self.render_cache = RenderCache()
             
             print("✅ Image Generator initialized successfully!")
             
@@ -60,6 +175,53 @@ class ImageGenerator:
             print(f"❌ Error loading models: {e}")
             print("   Will use simplified mode for testing")
             self.pipe = None
+            self.prompt_cache = None
+            self.render_cache = None
+    
+    def map_weights(self):
+        """Memory-map the UNet, VAE, ControlNet and text encoder weights; returns bytes mapped"""
+        models = cpu_perf.pipeline_models(self.pipe) + [("text_encoder", self.pipe.text_encoder)]
+        return sum(model_store.map_model_weights(model) for _, model in models)
+    
+    def mapped_bytes(self):
+        """Bytes of the pipeline's weights still shared through the memory maps"""
+        models = cpu_perf.pipeline_models(self.pipe) + [("text_encoder", self.pipe.text_encoder)]
+        return sum(model_store.mapped_bytes(model) for _, model in models)
+    
+    def set_scheduler(self, name):
+        """Swap the sampler; LCM also switches the LCM-LoRA weights on"""
+        if name == self.scheduler_name:
+            return
+        if name not in self.SCHEDULERS:
+            raise ValueError(f"scheduler must be one of {list(self.SCHEDULERS)}")
+        
+        if name == 'dpm++':
+            scheduler = DPMSolverMultistepScheduler.from_config(
+                self.scheduler_config, algorithm_type="dpmsolver++", use_karras_sigmas=True
+            )
+        else:
+            scheduler = self.SCHEDULERS[name].from_config(self.scheduler_config)
+        
+        if name == 'lcm':
+            if not self.lcm_loaded:
+                print(f"   Loading LCM-LoRA ({self.LCM_LORA})...")
+                self.pipe.load_lora_weights(self.LCM_LORA)
+                self.lcm_loaded = True
+            else:
+                self.pipe.enable_lora()
+        elif self.lcm_loaded and self.scheduler_name == 'lcm':
+            self.pipe.disable_lora()
+        
+        self.pipe.scheduler = scheduler
+        self.scheduler_name = name
+        print(f"   Scheduler: {name}")
+    
+    def use_tier(self, tier):
+        """Apply a latency tier's sampler; returns its (steps, guidance_scale)"""
+        settings = self.TIERS[tier]
+        if self.pipe is not None:
+            self.set_scheduler(settings['scheduler'])
+        return settings['steps'], settings['guidance_scale']
     
     def prepare_control_images(self, depth_map_path, masks_folder):
         """
@@ -72,118 +234,444 @@ class ImageGenerator:
             # Create blank image if depth map not found
             depth_image = Image.new('RGB', (512, 512), color='gray')
         
-        # Create segmentation map from masks
-        seg_image = self.create_segmentation_map(masks_folder)
+        # ADE20K label maps are already the ControlNet conditioning image;
+        # anything else is converted from masks
+        label_map = LabelMap.find(masks_folder) if os.path.exists(masks_folder) else None
+        if label_map is not None and label_map.palette_name == 'ade20k':
+            seg_image = label_map.color_image()
+        else:
+            seg_image = self.create_segmentation_map(masks_folder)
         
         return depth_image, seg_image
     
-    def create_segmentation_map(self, masks_folder):
+    def create_segmentation_map(self, masks_folder, size=(512, 512)):
         """
-        Combine individual masks into a single segmentation map
+        Combine individual masks into a single segmentation map.
+        All masks become one label array, colored with a single lookup and
+        resized once (nearest, so no colors blend) to size = (width, height).
+        Cached per room folder, since every style of a room uses the same map.
         """
-        # Define colors for different object types (RGB)
-        color_map = {
-            'chair': (255, 0, 0),      # Red
-            'couch': (0, 255, 0),       # Green
-            'bed': (0, 0, 255),          # Blue
-            'dining table': (255, 255, 0),  # Yellow
-            'tv': (255, 0, 255),         # Magenta
-            'potted plant': (0, 255, 255),  # Cyan
-            'refrigerator': (128, 0, 0),  # Dark red
-            'sink': (0, 128, 0),         # Dark green
-            'train': (0, 0, 128),         # Dark blue
-            'boat': (128, 128, 0),        # Olive
-            'fire hydrant': (128, 0, 128), # Purple
-            'bird': (0, 128, 128),        # Teal
-        }
-        
-        # Create blank segmentation map
-        seg_map = Image.new('RGB', (512, 512), color='black')
-        
         if not os.path.exists(masks_folder):
-            return seg_map
+            return Image.new('RGB', size, color='black')
         
-        # Get all mask files
-        mask_files = [f for f in os.listdir(masks_folder) if f.endswith('.png') and 'segmentation' not in f]
+        # Cache key includes the folder's files and mtimes, so re-segmented rooms are rebuilt
+        files = tuple(sorted((f, os.path.getmtime(os.path.join(masks_folder, f)))
+                             for f in os.listdir(masks_folder)))
+        key = (os.path.abspath(masks_folder), tuple(size), files)
+        if key in self.seg_maps:
+            return self.seg_maps[key]
         
+        labels, colors = self._mask_labels(masks_folder)
+        if labels is None:
+            seg_map = Image.new('RGB', size, color='black')
+        else:
+            labels = cv2.resize(labels, tuple(size), interpolation=cv2.INTER_NEAREST)
+            seg_map = Image.fromarray(colors[labels])
+        
+        self.seg_maps[key] = seg_map
+        while len(self.seg_maps) > self.SEG_MAP_CACHE_SIZE:
+            self.seg_maps.pop(next(iter(self.seg_maps)))
+        return seg_map
+    
+    def _mask_labels(self, masks_folder):
+        """
+        [H, W] uint8 color index per pixel and the [N, 3] colors it indexes
+        (index 0 is black background), or (None, None) without masks
+        """
+        # Masks come from the room's label map when MaskGenerator wrote one,
+        # else from legacy per-class PNGs
+        label_map = LabelMap.find(masks_folder)
+        if label_map is not None:
+            # Class ids map straight to colors; classes too small to count stay black
+            colors = np.zeros((256, 3), dtype=np.uint8)
+            for class_id, name in label_map.classes().items():
+                colors[class_id] = self.SEG_COLORS.get(name, (255, 255, 255))  # Default white
+            return label_map.labels, colors
+        
+        mask_files = sorted(f for f in os.listdir(masks_folder)
+                            if f.endswith('.png') and 'segmentation' not in f and '_labels' not in f)
+        
+        labels = None
+        colors = [(0, 0, 0)]
         for mask_file in mask_files:
             try:
-                # Determine object type from filename
-                obj_type = mask_file.split('_mask')[0]
-                color = color_map.get(obj_type, (255, 255, 255))  # Default white
-                
-                # Load mask
-                mask_path = os.path.join(masks_folder, mask_file)
-                mask = Image.open(mask_path).convert('L')
-                
-                # Convert mask to numpy for processing
-                mask_np = np.array(mask)
-                
-                # Create colored mask
-                colored_mask = np.zeros((512, 512, 3), dtype=np.uint8)
-                for i in range(3):
-                    colored_mask[:,:,i] = mask_np * color[i] // 255
-                
-                # Combine with existing segmentation map
-                seg_np = np.array(seg_map)
-                mask_bool = mask_np > 128
-                seg_np[mask_bool] = colored_mask[mask_bool]
-                seg_map = Image.fromarray(seg_np)
-                
+                mask = np.array(Image.open(os.path.join(masks_folder, mask_file)).convert('L'))
             except Exception as e:
                 print(f"   Warning: Could not process {mask_file}: {e}")
+                continue
+            
+            if labels is None:
+                labels = np.zeros(mask.shape, dtype=np.uint8)
+            elif mask.shape != labels.shape:
+                mask = cv2.resize(mask, labels.shape[::-1], interpolation=cv2.INTER_NEAREST)
+            
+            # Object type comes from the file name; later masks win on overlaps
+            obj_type = mask_file.split('_mask')[0]
+            labels[mask > 128] = len(colors)
+            colors.append(self.SEG_COLORS.get(obj_type, (255, 255, 255)))
+            if len(colors) == 256:
+                break
         
-        return seg_map
+        return labels, np.array(colors, dtype=np.uint8)
     
     def generate_image(self, prompt, negative_prompt, depth_image, seg_image, 
-                      output_path, num_inference_steps=25, guidance_scale=7.5):
+                      output_path, num_inference_steps=25, guidance_scale=7.5, seed=None):
         """
         Generate a redesigned image using ControlNet
         """
-        print(f"   Generating image with {num_inference_steps} steps...")
+        return self.generate_images([prompt], [negative_prompt], [depth_image], [seg_image],
+                                    [output_path], num_inference_steps, guidance_scale,
+                                    seeds=None if seed is None else [seed])[0]
+    
+    def render_keys(self, prompts, negative_prompts, depth_images, seg_images, seeds,
+                    num_inference_steps, guidance_scale):
+        """Render cache key per sample, from everything that determines the image"""
+        # Control images are hashed once each, even when shared by the batch
+        hashes = {}
+        for img in depth_images + seg_images:
+            if id(img) not in hashes:
+                hashes[id(img)] = image_hash(img)
+        
+        if len(depth_images) == 1:
+            depth_images = depth_images * len(prompts)
+            seg_images = seg_images * len(prompts)
+        
+        # The prompt cache key stands for the embedding (model, tokenizer, text)
+        prompt_key = self.prompt_cache.key if self.prompt_cache is not None else (lambda text: text)
+        
+        return [render_key(
+            models=[self.SD_MODEL, self.CONTROLNET_DEPTH, self.CONTROLNET_SEG],
+            lora=self.LCM_LORA if self.scheduler_name == 'lcm' else None,
+            dtype="bfloat16" if self.bf16 else "float32",
+            prompt=prompt_key(prompt),
+            negative_prompt=prompt_key(negative_prompt),
+            depth=hashes[id(depth)],
+            seg=hashes[id(seg)],
+            scheduler=self.scheduler_name,
+            steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            seed=seed,
+            size=[512, 512],
+        ) for prompt, negative_prompt, depth, seg, seed
+            in zip(prompts, negative_prompts, depth_images, seg_images, seeds)]
+    
+    def generate_images(self, prompts, negative_prompts, depth_images, seg_images,
+                        output_paths, num_inference_steps=25, guidance_scale=7.5, generator=None,
+                        fallback=True, seeds=None, progress=None):
+        """
+        Generate several redesigned images in one batched pipeline call.
+        depth_images / seg_images hold either one image shared by every sample
+        or one image per sample. Shared control images are preprocessed once
+        and broadcast across the batch by the pipeline.
+        seeds (one per sample) make renders reproducible and cacheable: samples
+        already in the render cache are not generated again.
+        progress (utils/render_progress.py, one name per sample) receives
+        latent previews while rendering; a cancel request stops the call and
+        raises RenderCancelled without saving anything.
+        With fallback=False a failed call raises instead of saving placeholders.
+        """
+        print(f"   Generating {len(prompts)} image(s) with {num_inference_steps} steps...")
         
         if self.pipe is None:
-            print("   Model not loaded - creating placeholder image")
+            print("   Model not loaded - creating placeholder images")
             # Create a simple placeholder
-            img = Image.new('RGB', (512, 512), color='gray')
-            img.save(output_path)
-            return img
+            images = []
+            for output_path in output_paths:
+                img = Image.new('RGB', (512, 512), color='gray')
+                img.save(output_path)
+                images.append(img)
+            return images
         
         try:
             # Resize control images to 512x512
-            depth_image = depth_image.resize((512, 512))
-            seg_image = seg_image.resize((512, 512))
+            depth_images = [img.resize((512, 512)) for img in depth_images]
+            # Nearest keeps the segmentation colors exact
+            seg_images = [img.resize((512, 512), Image.NEAREST) for img in seg_images]
             
-            # Generate image
-            with torch.no_grad():
-                result = self.pipe(
-                    prompt=prompt,
-                    negative_prompt=negative_prompt,
-                    image=[depth_image, seg_image],
-                    num_inference_steps=num_inference_steps,
-                    guidance_scale=guidance_scale,
-                    height=512,
-                    width=512
-                ).images[0]
+            # Look up seeded samples in the render cache
+            images = [None] * len(prompts)
+            keys = [None] * len(prompts)
+            if seeds is not None:
+                generator = [torch.Generator(device="cpu").manual_seed(seed) for seed in seeds]
+                if self.render_cache is not None:
+                    keys = self.render_keys(prompts, negative_prompts, depth_images, seg_images, seeds,
+                                            num_inference_steps, guidance_scale)
+                    images = [self.render_cache.get(key) for key in keys]
             
-            # Save result
-            result.save(output_path)
-            print(f"   ✅ Image saved")
-            return result
+            todo = [i for i, image in enumerate(images) if image is None]
+            if len(todo) < len(prompts):
+                print(f"   ♻️  {len(prompts) - len(todo)} image(s) from the render cache")
             
+            if todo:
+                # One [depth, seg] pair is broadcast to every prompt; otherwise
+                # each sample gets its own pair
+                if len(depth_images) == 1:
+                    control_images = [depth_images[0], seg_images[0]]
+                else:
+                    control_images = [[depth_images[i], seg_images[i]] for i in todo]
+                
+                # Cached embeddings skip the text encoder for known prompts
+                todo_prompts = [prompts[i] for i in todo]
+                todo_negative_prompts = [negative_prompts[i] for i in todo]
+                if self.prompt_cache is not None:
+                    prompt_args = {
+                        "prompt_embeds": self.prompt_cache.encode(todo_prompts),
+                        "negative_prompt_embeds": self.prompt_cache.encode(todo_negative_prompts),
+                    }
+                else:
+                    prompt_args = {"prompt": todo_prompts, "negative_prompt": todo_negative_prompts}
+                
+                if isinstance(generator, list):
+                    generator = [generator[i] for i in todo]
+                
+                # Per-step timing only when profiling, previews only when asked;
+                # bf16 autocast is a no-op otherwise
+                channel = progress.subset(todo) if progress is not None else None
+                callback = chain_callbacks([
+                    self.step_timer,
+                    PreviewCallback(channel, self.PREVIEW_EVERY) if channel is not None else None,
+                ])
+                extra_args = {"callback_on_step_end": callback} if callback is not None else {}
+                if self.step_timer is not None:
+                    self.step_timer.start()
+                
+                # Generate all images in one call with per-sample prompts
+                with torch.no_grad(), cpu_perf.autocast(self.bf16):
+                    results = self.pipe(
+                        **extra_args,
+                        **prompt_args,
+                        image=control_images,
+                        num_inference_steps=num_inference_steps,
+                        guidance_scale=guidance_scale,
+                        generator=generator,
+                        height=512,
+                        width=512
+                    ).images
+                
+                # An interrupted call still decodes its half-denoised latents
+                cancelled = channel.cancelled() if channel is not None else []
+                if cancelled:
+                    # The other samples are not cancelled (the queue puts them back)
+                    progress.finish('cancelled', cancelled)
+                    print(f"   ⏹️  Cancelled: {', '.join(cancelled)}")
+                    raise RenderCancelled(cancelled)
+                
+                for i, result in zip(todo, results):
+                    images[i] = result
+                    if keys[i] is not None:
+                        self.render_cache.put(keys[i], result)
+                
+                if self.step_timer is not None:
+                    print(f"   📈 {self.step_timer.mean_ms():.0f} ms/step (batch of {len(results)}), "
+                          f"peak RSS {cpu_perf.peak_rss_mb():.0f} MB")
+            
+            # Save results
+            for image, output_path in zip(images, output_paths):
+                image.save(output_path)
+            print(f"   ✅ {len(images)} image(s) saved")
+            if progress is not None:
+                progress.finish('done')
+            return images
+            
+        except RenderCancelled:
+            raise
         except Exception as e:
             print(f"   ❌ Generation failed: {e}")
-            # Create fallback image
-            img = Image.new('RGB', (512, 512), color='lightgray')
-            img.save(output_path)
-            return img
+            if progress is not None:
+                progress.finish('failed')
+            if not fallback:
+                raise
+            # Create fallback images
+            images = []
+            for output_path in output_paths:
+                img = Image.new('RGB', (512, 512), color='lightgray')
+                img.save(output_path)
+                images.append(img)
+            return images
     
-    def process_all_styles(self, image_name, prompts, depth_folder, masks_folder, output_folder):
+    def region_mask(self, masks_folder, class_names):
         """
-        Generate images for all styles for a given input image
+        Boolean [H, W] mask of the given object classes (e.g. ['couch', 'bed'])
+        from the room's MaskGenerator output, or None if none of them were found.
+        VOC and ADE20K names are interchangeable ('couch' also matches 'sofa').
         """
-        print(f"\n📸 Processing: {image_name}")
+        if not os.path.exists(masks_folder):
+            return None
+        
+        wanted = set().union(*(ade20k.class_aliases(name) for name in class_names))
+        
+        label_map = LabelMap.find(masks_folder)
+        if label_map is not None:
+            classes = label_map.classes()
+            class_ids = [class_id for class_id, name in classes.items() if name in wanted]
+            if not class_ids:
+                print(f"   ⚠️ Classes found in this room: {', '.join(sorted(classes.values())) or 'none'}")
+                return None
+            return label_map.mask(class_ids)
+        
+        # Legacy per-class PNGs: <class>_mask_<id>.png
+        mask = None
+        for mask_file in sorted(os.listdir(masks_folder)):
+            if mask_file.endswith('.png') and mask_file.split('_mask')[0] in wanted:
+                class_mask = np.array(Image.open(os.path.join(masks_folder, mask_file)).convert('L')) > 128
+                mask = class_mask if mask is None else mask | class_mask
+        return mask
+    
+    def _inpaint_box(self, mask, padding):
+        """Padded bounding box of the mask and the size to render it at (multiples of 8)"""
+        ys, xs = np.nonzero(mask)
+        height, width = mask.shape
+        box = (max(int(xs.min()) - padding, 0), max(int(ys.min()) - padding, 0),
+               min(int(xs.max()) + 1 + padding, width), min(int(ys.max()) + 1 + padding, height))
+        
+        box_width, box_height = box[2] - box[0], box[3] - box[1]
+        long_side = max(box_width, box_height)
+        scale = min(max(long_side, self.INPAINT_MIN_SIDE), self.INPAINT_MAX_SIDE) / long_side
+        render_size = (max(8, int(round(box_width * scale / 8)) * 8),
+                       max(8, int(round(box_height * scale / 8)) * 8))
+        return box, render_size
+    
+    def get_inpaint_pipe(self):
+        """Inpainting pipeline built on the loaded pipeline's modules (no extra weights)"""
+        if self.inpaint_pipe is None:
+            self.inpaint_pipe = StableDiffusionControlNetInpaintPipeline(**self.pipe.components)
+        # Follows set_scheduler / use_tier
+        self.inpaint_pipe.scheduler = self.pipe.scheduler
+        return self.inpaint_pipe
+    
+    def inpaint_images(self, image, mask, prompts, negative_prompts, depth_image, seg_image,
+                       output_paths, strength=0.8, num_inference_steps=25, guidance_scale=7.5,
+                       seeds=None, padding=32, progress=None):
+        """
+        Regenerate only the masked region of a room image, one output per prompt.
+        Only the mask's padded bounding box goes through the pipeline, at
+        INPAINT_MIN_SIDE-INPAINT_MAX_SIDE pixels on its long side; the result is
+        pasted back with a feathered mask, so the rest of the room is untouched.
+        strength: how far the region is re-noised (1.0 = generated from scratch).
+        """
+        image = image.convert('RGB')
+        if mask.shape != (image.height, image.width):
+            mask = cv2.resize(mask.astype(np.uint8), image.size, interpolation=cv2.INTER_NEAREST) > 0
+        
+        if not mask.any() or self.pipe is None:
+            print("   No region to redesign - keeping the original image" if self.pipe is not None
+                  else "   Model not loaded - keeping the original image")
+            for output_path in output_paths:
+                image.save(output_path)
+            return [image] * len(output_paths)
+        
+        box, render_size = self._inpaint_box(mask, padding)
+        print(f"   Inpainting {len(prompts)} image(s): region {box[2] - box[0]}x{box[3] - box[1]} "
+              f"rendered at {render_size[0]}x{render_size[1]}, strength {strength}")
+        
+        # Image, mask and control images cropped to the same box
+        mask_image = Image.fromarray(mask.astype(np.uint8) * 255)
+        init_crop = image.crop(box).resize(render_size, Image.LANCZOS)
+        mask_crop = mask_image.crop(box).resize(render_size, Image.NEAREST)
+        depth_crop = depth_image.convert('RGB').resize(image.size).crop(box).resize(render_size)
+        seg_crop = seg_image.convert('RGB').resize(image.size, Image.NEAREST).crop(box).resize(render_size, Image.NEAREST)
+        
+        if self.prompt_cache is not None:
+            prompt_args = {
+                "prompt_embeds": self.prompt_cache.encode(list(prompts)),
+                "negative_prompt_embeds": self.prompt_cache.encode(list(negative_prompts)),
+            }
+        else:
+            prompt_args = {"prompt": list(prompts), "negative_prompt": list(negative_prompts)}
+        
+        generator = None
+        if seeds is not None:
+            generator = [torch.Generator(device="cpu").manual_seed(seed) for seed in seeds]
+        
+        callback = chain_callbacks([
+            self.step_timer,
+            PreviewCallback(progress, self.PREVIEW_EVERY) if progress is not None else None,
+        ])
+        extra_args = {"callback_on_step_end": callback} if callback is not None else {}
+        if self.step_timer is not None:
+            self.step_timer.start()
+        
+        with torch.no_grad(), cpu_perf.autocast(self.bf16):
+            results = self.get_inpaint_pipe()(
+                **extra_args,
+                **prompt_args,
+                image=init_crop,
+                mask_image=mask_crop,
+                control_image=[depth_crop, seg_crop],
+                strength=strength,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale,
+                # Same ControlNet weight as full generation (this pipeline defaults to 0.5)
+                controlnet_conditioning_scale=1.0,
+                generator=generator,
+                height=render_size[1],
+                width=render_size[0]
+            ).images
+        
+        cancelled = progress.cancelled() if progress is not None else []
+        if cancelled:
+            progress.finish('cancelled', cancelled)
+            raise RenderCancelled(cancelled)
+        
+        # Feathered paste: grow the mask a little and soften its edge
+        box_size = (box[2] - box[0], box[3] - box[1])
+        alpha = mask_image.crop(box).filter(ImageFilter.MaxFilter(5)).filter(ImageFilter.GaussianBlur(3))
+        
+        images = []
+        for result, output_path in zip(results, output_paths):
+            redesigned = image.copy()
+            redesigned.paste(result.resize(box_size, Image.LANCZOS), box[:2], alpha)
+            redesigned.save(output_path)
+            images.append(redesigned)
+        print(f"   ✅ {len(images)} image(s) saved")
+        
+        if progress is not None:
+            progress.finish('done')
+        return images
+    
+    def redesign_objects(self, image_name, prompts, class_names, input_folder, depth_folder,
+                         masks_folder, output_folder, strength=0.8, tier=None):
+        """
+        Partial redesign: restyle only the given object classes of one room,
+        in every style, keeping the rest of the original image
+        """
+        print(f"\n🛋️  Redesigning {', '.join(class_names)} in {image_name}")
+        os.makedirs(output_folder, exist_ok=True)
+        
+        base_name = os.path.splitext(image_name)[0]
+        masks_path = os.path.join(masks_folder, base_name)
+        mask = self.region_mask(masks_path, class_names)
+        if mask is None:
+            print(f"   ⚠️ No {', '.join(class_names)} found in {image_name}")
+            return []
         
+        jobs = self.style_jobs(image_name, prompts, depth_folder, masks_folder, output_folder)
+        suffix = "_".join(name.replace(' ', '-') for name in class_names)
+        output_paths = [os.path.join(output_folder, f"{base_name}_{style}_{suffix}.png") for style in prompts]
+        
+        num_inference_steps, guidance_scale = self.use_tier(tier or self.tier)
+        start_time = time.time()
+        self.inpaint_images(
+            Image.open(os.path.join(input_folder, image_name)),
+            mask,
+            prompts=[job["prompt"] for job in jobs],
+            negative_prompts=[job["negative_prompt"] for job in jobs],
+            depth_image=jobs[0]["depth_image"],
+            seg_image=jobs[0]["seg_image"],
+            output_paths=output_paths,
+            strength=strength,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            seeds=[job["seed"] for job in jobs]
+        )
+        print(f"   ⏱️  Time: {time.time() - start_time:.1f} seconds")
+        return output_paths
+    
+    def style_jobs(self, image_name, prompts, depth_folder, masks_folder, output_folder):
+        """
+        One job per style for an input image, all sharing the room's
+        control images (prepared once). Each job has a fixed seed.
+        """
         # Get base name without extension
         base_name = os.path.splitext(image_name)[0]
         
@@ -193,36 +681,76 @@ class ImageGenerator:
         
         depth_image, seg_image = self.prepare_control_images(depth_path, masks_path)
         
-        # Generate for each style
-        generated_images = []
+        return [{
+            "image_name": image_name,
+            "style": style_data['style'],
+            "prompt": style_data['positive'],
+            "negative_prompt": style_data['negative'],
+            "depth_image": depth_image,
+            "seg_image": seg_image,
+            "output_path": os.path.join(output_folder, f"{base_name}_{style}.png"),
+            "seed": job_seed(image_name, style),
+        } for style, style_data in prompts.items()]
+    
+    def run_jobs(self, jobs, batch_size=6, tier=None):
+        """
+        Generate jobs in batches of up to batch_size images per pipeline call.
+        A batch may span rooms; control images are then passed per sample.
+        Each job runs at its own "tier" if set, else at tier / self.tier;
+        jobs are grouped by tier so the sampler changes once per group.
+        """
+        by_tier = {}
+        for job in jobs:
+            by_tier.setdefault(job.get("tier") or tier or self.tier, []).append(job)
         
-        for style, style_data in prompts.items():
-            print(f"\n   🎨 Style: {style_data['style']}")
-            
-            # Create output filename
-            output_filename = f"{base_name}_{style}.png"
-            output_path = os.path.join(output_folder, output_filename)
+        for job_tier in sorted(by_tier, key=list(self.TIERS).index):
+            tier_jobs = by_tier[job_tier]
+            num_inference_steps, guidance_scale = self.use_tier(job_tier)
+            print(f"\n   ⚡ Tier: {job_tier} ({num_inference_steps} steps, {len(tier_jobs)} images)")
             
-            # Generate image
-            start_time = time.time()
-            self.generate_image(
-                prompt=style_data['positive'],
-                negative_prompt=style_data['negative'],
-                depth_image=depth_image,
-                seg_image=seg_image,
-                output_path=output_path,
-                num_inference_steps=20  # Lower steps for CPU speed
-            )
-            elapsed = time.time() - start_time
-            print(f"   ⏱️  Time: {elapsed:.1f} seconds")
-            
-            generated_images.append(output_path)
+            for i in range(0, len(tier_jobs), batch_size):
+                batch = tier_jobs[i:i + batch_size]
+                rooms = sorted(set(job["image_name"] for job in batch))
+                print(f"\n   🎨 Batch: {', '.join(job['style'] for job in batch)} ({', '.join(rooms)})")
+                
+                depth_images = [job["depth_image"] for job in batch]
+                seg_images = [job["seg_image"] for job in batch]
+                if len(rooms) == 1:
+                    depth_images, seg_images = depth_images[:1], seg_images[:1]
+                
+                start_time = time.time()
+                self.generate_images(
+                    prompts=[job["prompt"] for job in batch],
+                    negative_prompts=[job["negative_prompt"] for job in batch],
+                    depth_images=depth_images,
+                    seg_images=seg_images,
+                    output_paths=[job["output_path"] for job in batch],
+                    num_inference_steps=num_inference_steps,
+                    guidance_scale=guidance_scale,
+                    seeds=[job["seed"] for job in batch]
+                )
+                elapsed = time.time() - start_time
+                print(f"   ⏱️  Time: {elapsed:.1f} seconds ({elapsed / len(batch):.1f} per image)")
+    
+    def process_all_styles(self, image_name, prompts, depth_folder, masks_folder, output_folder,
+                           batch_size=6, tier=None):
+        """
+        Generate images for all styles for a given input image.
+        All styles run as one batched call (batch_size caps images per call).
+        """
+        print(f"\n📸 Processing: {image_name}")
         
-        return generated_images
+        jobs = self.style_jobs(image_name, prompts, depth_folder, masks_folder, output_folder)
+        self.run_jobs(jobs, batch_size, tier)
+        
+        return [job["output_path"] for job in jobs]
     
-    def process_all_images(self, prompts_file, depth_folder, masks_folder, output_folder):
+    def process_all_images(self, prompts_file, depth_folder, masks_folder, output_folder,
+                           batch_size=6, tier=None):
         """
-        Process all images with all styles
+        Process all images with all styles.
+        Jobs from every room go through run_jobs together, so a batch_size
+        above the number of styles also batches across rooms.
         """
         print("\n" + "="*60)
         print("Starting batch image generation...")
@@ -237,14 +765,22 @@ class ImageGenerator:
         
         print(f"📁 Found {len(all_prompts)} images to process")
         
-        # Process each image
+        # Encode every prompt up front, in batches, before any generation
+        if self.prompt_cache is not None:
+            count = self.prompt_cache.warm_up(all_prompts)
+            print(f"🔤 {count} prompts ready ({self.prompt_cache.misses} newly encoded)")
+        
+        # Collect every room's jobs
+        all_jobs = []
         all_results = {}
         
         for image_name, prompts in all_prompts.items():
-            results = self.process_all_styles(
-                image_name, prompts, depth_folder, masks_folder, output_folder
-            )
-            all_results[image_name] = results
+            print(f"\n📸 Preparing: {image_name}")
+            jobs = self.style_jobs(image_name, prompts, depth_folder, masks_folder, output_folder)
+            all_jobs.extend(jobs)
+            all_results[image_name] = [job["output_path"] for job in jobs]
+        
+        self.run_jobs(all_jobs, batch_size, tier)
         
         # Save summary
         summary_file = os.path.join(output_folder, "generation_summary.txt")
@@ -276,8 +812,11 @@ def main():
         print(f"❌ Prompts file not found: {prompts_file}")
         return
     
+    # Latency tier per run, e.g. `python image_generator.py draft`
+    tier = sys.argv[1] if len(sys.argv) > 1 else 'standard'
+    
     # Create generator
-    generator = ImageGenerator()
+    generator = ImageGenerator(tier=tier)
     
     # Process all images
     generator.process_all_images(prompts_file, depth_folder, masks_folder, output_folder)
@@ -0,0 +1,57 @@
+"""
+Partial redesign
+Restyles only selected furniture (e.g. the couch) of a room in every style,
+by inpainting the MaskGenerator masks; the rest of the photo stays as it was.
+
+Run from the 04-image-generation folder:
+    python partial_redesign.py <image_name> <class[,class...]> [strength] [tier]
+    python partial_redesign.py room1.jpg couch,chair 0.8 fast
+"""
+
+import os
+import sys
+import json
+
+from image_generator import ImageGenerator
+
+
+def main():
+    print("=" * 50)
+    print("Partial Redesign")
+    print("=" * 50)
+
+    # Paths
+    prompts_file = "../data/prompts/prompts.json"
+    input_folder = "../data/input_images"
+    depth_folder = "../data/depth_maps"
+    masks_folder = "../data/masks"
+    output_folder = "../data/outputs/partial"
+
+    if len(sys.argv) < 3:
+        print("Usage: python partial_redesign.py <image_name> <class[,class...]> [strength] [tier]")
+        return
+
+    image_name = sys.argv[1]
+    class_names = sys.argv[2].split(',')
+    strength = float(sys.argv[3]) if len(sys.argv) > 3 else 0.8
+    tier = sys.argv[4] if len(sys.argv) > 4 else 'standard'
+
+    if not os.path.exists(prompts_file):
+        print(f"❌ Prompts file not found: {prompts_file}")
+        return
+
+    with open(prompts_file, 'r') as f:
+        all_prompts = json.load(f)
+    if image_name not in all_prompts:
+        print(f"❌ No prompts for {image_name}")
+        return
+
+    generator = ImageGenerator(tier=tier)
+    outputs = generator.redesign_objects(image_name, all_prompts[image_name], class_names, input_folder,
+                                         depth_folder, masks_folder, output_folder, strength=strength)
+    for output in outputs:
+        print(f"   💾 {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Queued image generation
+Renders go through the SQLite job queue (utils/job_queue.py) instead of one
+in-process loop: a crashed or stopped run resumes where it left off, outputs
+already rendered from the same inputs are skipped, and any number of worker
+processes on this host can drain the same queue (SQLite's WAL locking does
+not work across hosts sharing a network folder).
+
+Run from the 04-image-generation folder:
+    python render_queue.py enqueue [tier] [base_seed]
+    python render_queue.py work [batch_size]
+    python render_queue.py status
+"""
+
+import os
+import sys
+import json
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.job_queue import JobQueue, job_seed, default_worker_id
+from utils.render_progress import RenderProgress, RenderCancelled
+
+# Paths
+PROMPTS_FILE = "../data/prompts/prompts.json"
+DEPTH_FOLDER = "../data/depth_maps"
+MASKS_FOLDER = "../data/masks"
+OUTPUT_FOLDER = "../data/outputs/images"
+
+
+def input_files(depth_path, masks_path):
+    """The files a job's control images are built from"""
+    paths = [depth_path] if os.path.exists(depth_path) else []
+    if os.path.isdir(masks_path):
+        paths += [os.path.join(masks_path, f) for f in sorted(os.listdir(masks_path))
+                  if f.endswith(('.png', '.json'))]
+    return paths
+
+
+def enqueue_all(queue, prompts_file, depth_folder, masks_folder, output_folder,
+                tier='standard', base_seed=0):
+    """One job per (image, style); returns counts of added / requeued / existing jobs"""
+    with open(prompts_file, 'r') as f:
+        all_prompts = json.load(f)
+
+    os.makedirs(output_folder, exist_ok=True)
+    counts = Counter()
+
+    for image_name, prompts in all_prompts.items():
+        base_name = os.path.splitext(image_name)[0]
+        depth_path = os.path.abspath(os.path.join(depth_folder, f"{base_name}_depth.png"))
+        masks_path = os.path.abspath(os.path.join(masks_folder, base_name))
+        inputs = input_files(depth_path, masks_path)
+
+        for style, style_data in prompts.items():
+            params = {
+                "prompt": style_data['positive'],
+                "negative_prompt": style_data['negative'],
+                "tier": tier,
+                "depth_path": depth_path,
+                "masks_path": masks_path,
+            }
+            output_path = os.path.abspath(os.path.join(output_folder, f"{base_name}_{style}.png"))
+            seed = job_seed(image_name, style, base_seed)
+            counts[queue.enqueue(image_name, style, seed, params, output_path, inputs)] += 1
+
+    return counts
+
+
+def work(generator, queue, batch_size=6, worker=None, max_attempts=3):
+    """
+    Claim and render jobs until the queue is empty.
+    Each claim is up to batch_size styles of one room at one tier, so the
+    room's control images are prepared once and the batch is one pipeline call.
+    """
+    worker = worker or default_worker_id()
+    controls = {}
+    rendered = 0
+
+    while True:
+        jobs = queue.claim(worker, batch_size)
+        if not jobs:
+            break
+
+        image_name = jobs[0]["image"]
+        params = jobs[0]["params"]
+        print(f"\n📸 {image_name}: {', '.join(job['style'] for job in jobs)}")
+
+        try:
+            # Only the current room's control images are kept
+            if image_name not in controls:
+                controls = {image_name: generator.prepare_control_images(params["depth_path"], params["masks_path"])}
+            depth_image, seg_image = controls[image_name]
+
+            num_inference_steps, guidance_scale = generator.use_tier(params["tier"])
+
+            start_time = time.time()
+            generator.generate_images(
+                prompts=[job["params"]["prompt"] for job in jobs],
+                negative_prompts=[job["params"]["negative_prompt"] for job in jobs],
+                depth_images=[depth_image],
+                seg_images=[seg_image],
+                output_paths=[job["output_path"] for job in jobs],
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale,
+                # Seeded per job, so a retried job reproduces the same image
+                seeds=[job["seed"] for job in jobs],
+                fallback=False,
+                # Previews in data/progress/job-<id>.png; cancel with
+                # python -m utils.render_progress cancel job-<id>
+                progress=RenderProgress([f"job-{job['id']}" for job in jobs])
+            )
+        except KeyboardInterrupt:
+            queue.release([job["id"] for job in jobs], worker)
+            print("\n⏹️  Stopped, claimed jobs returned to the queue")
+            raise
+        except RenderCancelled as e:
+            # Cancelled jobs are not retried; the rest of the batch goes back to the queue
+            for job in jobs:
+                if f"job-{job['id']}" in e.names:
+                    queue.fail(job["id"], worker, "cancelled", max_attempts=0)
+                else:
+                    queue.release([job["id"]], worker)
+            continue
+        except Exception as e:
+            for job in jobs:
+                queue.fail(job["id"], worker, e, max_attempts)
+            continue
+
+        for job in jobs:
+            # False if the lease expired and another worker took the job over
+            queue.complete(job["id"], worker)
+        rendered += len(jobs)
+        print(f"   ⏱️  Time: {time.time() - start_time:.1f} seconds")
+
+    return rendered
+
+
+def print_status(queue):
+    status = queue.status()
+    print(f"📊 {status['done']}/{status['total']} done, {status['running']} running, "
+          f"{status['pending']} pending, {status['failed']} failed")
+    for job in queue.failures():
+        print(f"   ❌ {job['image']} / {job['style']} ({job['attempts']} attempts): {job['error']}")
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    queue = JobQueue()
+
+    if command == 'enqueue':
+        if not os.path.exists(PROMPTS_FILE):
+            print(f"❌ Prompts file not found: {PROMPTS_FILE}")
+            return
+        tier = sys.argv[2] if len(sys.argv) > 2 else 'standard'
+        base_seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+        counts = enqueue_all(queue, PROMPTS_FILE, DEPTH_FOLDER, MASKS_FOLDER, OUTPUT_FOLDER, tier, base_seed)
+        print(f"📥 {counts['added']} added, {counts['requeued']} requeued, "
+              f"{counts['exists']} already queued or done")
+
+    elif command == 'work':
+        from image_generator import ImageGenerator
+
+        batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+        generator = ImageGenerator()
+        if generator.pipe is None:
+            # Placeholders must never be recorded as finished renders
+            print("❌ Models not loaded, not taking jobs")
+            return
+        rendered = work(generator, queue, batch_size)
+        print(f"\n✅ Queue empty, {rendered} image(s) rendered by this worker")
+
+    print_status(queue)
+
+
+if __name__ == "__main__":
+    main()
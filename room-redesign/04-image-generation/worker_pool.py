@@ -0,0 +1,101 @@
+"""
+Generation worker pool
+One ImageGenerator per render host instead of one per process: the parent
+loads Stable Diffusion + both ControlNets once, with memory-mapped weights,
+then forks workers that share those pages copy-on-write. Each worker is
+pinned to its own slice of cores and drains the render queue
+(render_queue.py), so throughput grows with cores while RAM stays near one
+model copy.
+
+Run from the 04-image-generation folder, after `render_queue.py enqueue`:
+    python worker_pool.py [cores_per_worker] [batch_size]
+"""
+
+import os
+import gc
+import sys
+import time
+import multiprocessing
+
+import torch
+
+from image_generator import ImageGenerator
+from render_queue import work, print_status
+from utils import cpu_perf
+from utils.job_queue import DEFAULT_DB_PATH, JobQueue, default_worker_id
+
+
+def core_slices(cores_per_worker, cores=None):
+    """Split the cores this process may use into one contiguous slice per worker"""
+    cores = sorted(cores if cores is not None else os.sched_getaffinity(0))
+    num_workers = max(1, len(cores) // cores_per_worker)
+    return [cores[i * cores_per_worker:(i + 1) * cores_per_worker] or cores
+            for i in range(num_workers)]
+
+
+def run_worker(generator, cores, db_path, batch_size):
+    """Worker body, run in the forked child"""
+    os.sched_setaffinity(0, cores)
+    threads = cpu_perf.tune_threads(len(cores))
+
+    # The SQLite connection is opened here: connections must not cross a fork
+    queue = JobQueue(db_path)
+    worker = default_worker_id()
+    print(f"🧵 Worker {worker}: cores {cores[0]}-{cores[-1]}, {threads} threads")
+
+    try:
+        rendered = work(generator, queue, batch_size, worker)
+    except KeyboardInterrupt:
+        return
+    print(f"✅ Worker {worker}: {rendered} image(s), peak RSS {cpu_perf.peak_rss_mb():.0f} MB")
+
+
+def run_pool(cores_per_worker=8, batch_size=6, tier='standard', db_path=DEFAULT_DB_PATH):
+    """Load the models once, fork one worker per core slice and wait for the queue to drain"""
+    slices = core_slices(cores_per_worker)
+    print(f"🏭 {len(slices)} worker(s) x {cores_per_worker} cores")
+
+    # Keep the parent single-threaded: an OpenMP pool started before fork()
+    # is not usable in the children
+    torch.set_num_threads(1)
+    generator = ImageGenerator(tier=tier, num_threads=1, mmap_weights=True)
+    if generator.pipe is None:
+        print("❌ Models not loaded, not starting workers")
+        return
+
+    # Objects allocated so far are never collected, so the garbage collector
+    # does not write to (and un-share) their pages in the workers
+    gc.collect()
+    gc.freeze()
+
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=run_worker, args=(generator, cores, db_path, batch_size))
+               for cores in slices]
+
+    start_time = time.time()
+    for process in workers:
+        process.start()
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        # The workers got the same Ctrl+C and hand their jobs back
+        for process in workers:
+            process.join()
+
+    print(f"\n⏱️  Pool time: {time.time() - start_time:.1f} seconds")
+    print_status(JobQueue(db_path))
+
+
+def main():
+    print("=" * 50)
+    print("Generation Worker Pool")
+    print("=" * 50)
+
+    cores_per_worker = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+    run_pool(cores_per_worker, batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ Flask web app to display original and redesigned rooms
 """
 
 import os
+import sys
 import json
 from flask import Flask, render_template, send_file, jsonify
 from PIL import Image
@@ -18,6 +19,9 @@ INPUT_IMAGES_DIR = os.path.join(BASE_DIR, "data", "input_images")
 OUTPUT_IMAGES_DIR = os.path.join(BASE_DIR, "data", "outputs", "images")
 REAL_SAMPLES_DIR = os.path.join(OUTPUT_IMAGES_DIR, "real_samples")  # Added this!
 
+sys.path.insert(0, BASE_DIR)
+from utils.render_progress import DEFAULT_PROGRESS_DIR, read_status, request_cancel
+
 # Styles available
 STYLES = ['modern', 'minimal', 'luxury', 'bohemian', 'industrial', 'scandinavian']
 
@@ -179,6 +183,25 @@ def get_all_images():
     
     return jsonify(images_data)
 
+@app.route('/api/progress')
+def get_progress():
+    """API endpoint: step / status of every render publishing progress"""
+    return jsonify(read_status())
+
+@app.route('/progress/<name>.png')
+def get_preview(name):
+    """Latest latent preview of a running render"""
+    preview_path = os.path.join(DEFAULT_PROGRESS_DIR, f"{os.path.basename(name)}.png")
+    if os.path.exists(preview_path):
+        return send_file(preview_path, max_age=0)
+    return "Preview not found", 404
+
+@app.route('/api/progress/<name>/cancel', methods=['POST'])
+def cancel_render(name):
+    """Stop a render at its next step"""
+    request_cancel(os.path.basename(name))
+    return jsonify({'cancelled': name})
+
 if __name__ == '__main__':
     # Print debug info
     print(f"Looking for images in:")
@@ -1,15 +1,42 @@
 import os
+import json
 import time
 
+from utils.job_queue import DEFAULT_DB_PATH, JobQueue
+
+def expected_images(prompts_file="data/prompts/prompts.json"):
+    """One image per (room, style) in prompts.json"""
+    if not os.path.exists(prompts_file):
+        return None
+    with open(prompts_file, 'r') as f:
+        return sum(len(prompts) for prompts in json.load(f).values())
+
 def check_progress():
     images_folder = "data/outputs/images"
-    
+
+    # Renders through render_queue.py: progress comes from the job queue
+    if os.path.exists(DEFAULT_DB_PATH):
+        queue = JobQueue(DEFAULT_DB_PATH)
+        while True:
+            status = queue.status()
+            print(f"\r📸 Images generated: {status['done']}/{status['total']} "
+                  f"({status['running']} running, {status['failed']} failed)", end="")
+            if status['pending'] == 0 and status['running'] == 0:
+                print()
+                return
+            time.sleep(5)
+
+    # In-process runs: count the files written so far
+    total = expected_images()
     while True:
         if os.path.exists(images_folder):
-            images = os.listdir(images_folder)
-            print(f"\r📸 Images generated: {len(images)}/18", end="")
-        
+            images = [f for f in os.listdir(images_folder) if f.endswith('.png')]
+            print(f"\r📸 Images generated: {len(images)}/{total or '?'}", end="")
+            if total and len(images) >= total:
+                print()
+                return
+
         time.sleep(5)
 
 if __name__ == "__main__":
-    check_progress()
\ No newline at end of file
+    check_progress()
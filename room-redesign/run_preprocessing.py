@@ -0,0 +1,97 @@
+"""
+Stages 1-3 in one run: depth maps, segmentation masks and prompts.
+Every input image is decoded once into a shared buffer; depth and
+segmentation then run concurrently on it, each with half of the cores, so
+the wall time is close to the slower of the two models instead of their sum.
+
+The buffer is a memory-mapped file (temp/decoded_images.bin by default), so
+the kernel can page it out and large folders do not have to fit in RAM.
+
+Run from the room-redesign folder:
+    python run_preprocessing.py [buffer_path]
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+for folder in ("01-depth-estimation", "02-segmentation", "03-prompt-engineering"):
+    sys.path.insert(0, os.path.join(ROOT, folder))
+
+DEFAULT_BUFFER_PATH = os.path.join(ROOT, "temp", "decoded_images.bin")
+
+from depth_generator import DepthGenerator
+from mask_generator import ADE20KMaskGenerator
+from prompt_generator import PromptGenerator
+from utils import cpu_perf
+from utils.decoded_images import DecodedImages
+
+
+def timed(name, fn, *args, **kwargs):
+    start = time.time()
+    result = fn(*args, **kwargs)
+    print(f"\n⏱️  {name}: {time.time() - start:.1f} seconds")
+    return result
+
+
+def run_depth(decoded, input_folder, output_folder):
+    DepthGenerator().process_folder(input_folder, output_folder, decoded=decoded)
+
+
+def run_segmentation(decoded, input_folder, output_folder):
+    ADE20KMaskGenerator().process_folder(input_folder, output_folder, decoded=decoded)
+
+
+def run_preprocessing(input_folder="data/input_images", depth_folder="data/depth_maps",
+                      masks_folder="data/masks", prompts_folder="data/prompts",
+                      buffer_path=DEFAULT_BUFFER_PATH):
+    start = time.time()
+    if buffer_path:
+        os.makedirs(os.path.dirname(os.path.abspath(buffer_path)), exist_ok=True)
+
+    # Decode once; both models read the same pixels
+    decoded = timed("Decode", DecodedImages, input_folder, buffer_path=buffer_path)
+    print(f"🖼️  Decoded {len(decoded)} images ({decoded.nbytes / 1e6:.1f} MB)")
+
+    # PyTorch releases the GIL during inference, so two threads are enough
+    # to keep both models busy at the same time. Each model gets half of the
+    # cores; two full-size intra-op pools would oversubscribe them.
+    threads = cpu_perf.tune_threads(max(1, cpu_perf.available_cores() // 2))
+    print(f"🧵 {threads} intra-op thread(s) per model")
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        depth = pool.submit(timed, "Depth", run_depth, decoded, input_folder, depth_folder)
+        masks = pool.submit(timed, "Segmentation", run_segmentation, decoded, input_folder, masks_folder)
+
+        # Prompts only need the file names, so they are done while the models run
+        generator = PromptGenerator()
+        prompts = generator.process_images(
+            input_folder, os.path.join(prompts_folder, "prompts.json"), images=decoded.names
+        )
+        if prompts:
+            generator.create_style_summary(prompts, prompts_folder)
+
+        depth.result()
+        masks.result()
+
+    print(f"\n✅ Stages 1-3 completed in {time.time() - start:.1f} seconds")
+
+
+def main():
+    print("=" * 50)
+    print("Stages 1-3: Depth, Segmentation, Prompts")
+    print("=" * 50)
+
+    input_folder = "data/input_images"
+    if not os.path.exists(input_folder):
+        print(f"❌ Input folder not found: {input_folder}")
+        return
+
+    buffer_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_BUFFER_PATH
+    run_preprocessing(input_folder, buffer_path=buffer_path)
+    print("➡️  Next: cd 04-image-generation && python image_generator.py")
+
+
+if __name__ == "__main__":
+    main()
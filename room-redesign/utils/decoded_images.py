@@ -0,0 +1,113 @@
+"""
+Decoded Images
+Every input image decoded once into a single RGB buffer that depth,
+segmentation and prompt generation all read from.
+
+The buffer is a plain in-memory array, or a memory-mapped file when a
+buffer_path is given (other processes can then map the same pixels).
+"""
+
+import os
+import json
+import numpy as np
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def list_images(input_folder):
+    return sorted(f for f in os.listdir(input_folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+
+class DecodedImages:
+    """[H, W, 3] uint8 views into one contiguous buffer, one per image"""
+
+    def __init__(self, input_folder, names=None, buffer_path=None, num_workers=4):
+        self.input_folder = input_folder
+        self.buffer_path = buffer_path
+        self.index = {}
+        self.errors = {}
+
+        # Sizes come from the headers, so the buffer is allocated up front
+        # and every image is decoded straight into its own slice
+        offset = 0
+        for name in (names if names is not None else list_images(input_folder)):
+            try:
+                with Image.open(os.path.join(input_folder, name)) as img:
+                    width, height = img.size
+            except Exception as e:
+                self.errors[name] = str(e)
+                continue
+            self.index[name] = (offset, (height, width, 3))
+            offset += height * width * 3
+
+        if buffer_path:
+            self.buffer = np.memmap(buffer_path, dtype=np.uint8, mode='w+', shape=(max(offset, 1),))
+        else:
+            self.buffer = np.empty(offset, dtype=np.uint8)
+
+        with ThreadPoolExecutor(max_workers=num_workers) as pool:
+            results = {name: pool.submit(self._decode, name) for name in self.index}
+            for name, future in results.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    self.errors[name] = str(e)
+
+        for name in self.errors:
+            self.index.pop(name, None)
+            print(f"❌ Error loading {name}: {self.errors[name]}")
+
+        if buffer_path:
+            self.buffer.flush()
+            self._save_index()
+
+    def _decode(self, name):
+        img = Image.open(os.path.join(self.input_folder, name)).convert('RGB')
+        view = self._view(name, writeable=True)
+        if (img.height, img.width, 3) != view.shape:
+            raise ValueError(f"decoded size {img.size} does not match header")
+        view[...] = np.asarray(img)
+
+    def _view(self, name, writeable=False):
+        offset, shape = self.index[name]
+        view = self.buffer[offset:offset + shape[0] * shape[1] * shape[2]].reshape(shape)
+        if not writeable:
+            view = view.view()
+            view.flags.writeable = False
+        return view
+
+    def _save_index(self):
+        with open(self.buffer_path + ".json", 'w') as f:
+            json.dump({name: [offset, list(shape)] for name, (offset, shape) in self.index.items()}, f)
+
+    @classmethod
+    def open(cls, buffer_path):
+        """Map a buffer written by another process, read-only"""
+        images = cls.__new__(cls)
+        images.input_folder = None
+        images.buffer_path = buffer_path
+        images.errors = {}
+        with open(buffer_path + ".json", 'r') as f:
+            images.index = {name: (offset, tuple(shape)) for name, (offset, shape) in json.load(f).items()}
+        images.buffer = np.memmap(buffer_path, dtype=np.uint8, mode='r')
+        return images
+
+    @property
+    def names(self):
+        return list(self.index.keys())
+
+    @property
+    def nbytes(self):
+        return int(self.buffer.nbytes)
+
+    def get(self, name):
+        """Read-only RGB array for one image"""
+        return self._view(name)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
@@ -0,0 +1,122 @@
+"""
+Raw Depth Storage
+Full-precision depth maps, readable zero-copy through memory mapping.
+
+Two layouts are supported:
+- one .npy per image next to the PNG preview (<name>_depth.npy)
+- a single store per folder: depth_store.bin holds the arrays back to back,
+  depth_store.json records each array's offset, shape and dtype; compact()
+  drops the bytes of arrays that were replaced by a different shape or dtype
+"""
+
+import os
+import json
+import threading
+import numpy as np
+
+
+class DepthStore:
+    """Folder-wide store of float depth maps"""
+
+    DATA_NAME = "depth_store.bin"
+    INDEX_NAME = "depth_store.json"
+
+    def __init__(self, folder):
+        self.data_path = os.path.join(folder, self.DATA_NAME)
+        self.index_path = os.path.join(folder, self.INDEX_NAME)
+        self.lock = threading.Lock()
+        self.index = {}
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self.index = json.load(f)
+
+    def put(self, name, depth):
+        """
+        Add a depth map. Re-writing a name with the same shape and dtype
+        overwrites it in place; otherwise the new copy is appended and the old
+        bytes stay in the file until compact().
+        """
+        depth = np.ascontiguousarray(depth)
+        with self.lock:
+            entry = self.index.get(name)
+            if entry and entry["shape"] == list(depth.shape) and entry["dtype"] == depth.dtype.str:
+                with open(self.data_path, 'r+b') as f:
+                    f.seek(entry["offset"])
+                    f.write(depth.tobytes())
+                return
+
+            with open(self.data_path, 'ab') as f:
+                offset = f.tell()
+                f.write(depth.tobytes())
+            self.index[name] = {
+                "offset": offset,
+                "shape": list(depth.shape),
+                "dtype": depth.dtype.str,
+            }
+            self._save_index()
+
+    def compact(self):
+        """Rewrite the data file with only the arrays in the index; returns the bytes freed"""
+        with self.lock:
+            if not os.path.exists(self.data_path):
+                return 0
+            size = os.path.getsize(self.data_path)
+            live = sum(int(np.prod(entry["shape"])) * np.dtype(entry["dtype"]).itemsize
+                       for entry in self.index.values())
+            if size <= live:
+                return 0
+
+            tmp_path = self.data_path + ".tmp"
+            index = {}
+            with open(tmp_path, 'wb') as out:
+                for name, entry in sorted(self.index.items(), key=lambda item: item[1]["offset"]):
+                    index[name] = {**entry, "offset": out.tell()}
+                    out.write(np.asarray(self._map(entry)).tobytes())
+            # Readers that already mapped the old file keep their pages
+            os.replace(tmp_path, self.data_path)
+            self.index = index
+            self._save_index()
+            return size - live
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def get(self, name):
+        """Read-only memory-mapped view of one depth map"""
+        return self._map(self.index[name])
+
+    def _map(self, entry):
+        return np.memmap(
+            self.data_path,
+            dtype=np.dtype(entry["dtype"]),
+            mode='r',
+            offset=entry["offset"],
+            shape=tuple(entry["shape"]),
+        )
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def names(self):
+        return list(self.index.keys())
+
+
+def load_depth(depth_folder, name):
+    """
+    Load raw depth for image `name` (base name, no extension) from either
+    layout, memory-mapped. Returns None if no raw depth was written.
+    """
+    npy_path = os.path.join(depth_folder, f"{name}_depth.npy")
+    if os.path.exists(npy_path):
+        return np.load(npy_path, mmap_mode='r')
+
+    if os.path.exists(os.path.join(depth_folder, DepthStore.INDEX_NAME)):
+        store = DepthStore(depth_folder)
+        if name in store:
+            return store.get(name)
+
+    return None
@@ -0,0 +1,246 @@
+"""
+Generation Job Queue
+Durable SQLite queue of (image, style, seed, params) render tasks, so long
+batches survive restarts and can be shared by several worker processes.
+All workers must run on the host that holds the database: WAL mode locks
+through shared memory, which does not work over network filesystems.
+
+- Claims are atomic: a worker takes jobs inside BEGIN IMMEDIATE, which holds
+  the database write lock, so two workers never get the same job.
+- A job that stays 'running' past its lease (worker crashed) is claimable again.
+- Jobs are keyed on a content hash of their inputs (control images, prompts,
+  seed, params): re-enqueueing unchanged work is a no-op, and a finished job
+  is only redone if its output file is missing or was changed.
+
+Progress from another terminal (from the room-redesign folder):
+    python check_progress.py
+"""
+
+import os
+import json
+import time
+import socket
+import hashlib
+import sqlite3
+
+DEFAULT_DB_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "jobs.sqlite3"
+)
+
+STATUSES = ("pending", "running", "done", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_key     TEXT NOT NULL UNIQUE,
+    image       TEXT NOT NULL,
+    style       TEXT NOT NULL,
+    seed        INTEGER NOT NULL,
+    params      TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'pending',
+    worker      TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    error       TEXT,
+    output_hash TEXT,
+    created_at  REAL NOT NULL,
+    claimed_at  REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+"""
+
+
+def file_hash(path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest
+
+
+def job_key(input_paths, style, seed, params):
+    """Content hash of everything that determines a job's output"""
+    digest = hashlib.sha256(json.dumps([style, seed, params], sort_keys=True).encode())
+    for path in sorted(input_paths):
+        digest.update(os.path.basename(path).encode())
+        file_hash(path, digest)
+    return digest.hexdigest()
+
+
+def job_seed(image, style, base_seed=0):
+    """Fixed seed per (image, style), so a re-run job renders the same image"""
+    digest = hashlib.sha256(f"{base_seed}|{image}|{style}".encode()).hexdigest()
+    return int(digest[:8], 16)
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    def __init__(self, path=DEFAULT_DB_PATH, lease_seconds=3600):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.lease_seconds = lease_seconds
+
+        # Autocommit mode; transactions are opened explicitly where needed
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        # WAL lets status queries read while a worker holds the write lock
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def enqueue(self, image, style, seed, params, output_path, input_paths):
+        """
+        Add a job unless identical work is already queued or done.
+        Returns 'added', 'exists' or 'requeued' (done, but output missing/changed).
+        """
+        key = job_key(input_paths, style, seed, params)
+        now = time.time()
+
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.db.execute(
+                "SELECT id, status, output_path, output_hash FROM jobs WHERE job_key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                # Inputs or params changed: the new job replaces older ones for the same output
+                self.db.execute(
+                    "DELETE FROM jobs WHERE output_path = ? AND status != 'running'", (output_path,)
+                )
+                self.db.execute(
+                    "INSERT INTO jobs (job_key, image, style, seed, params, output_path, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, image, style, seed, json.dumps(params, sort_keys=True), output_path, now),
+                )
+                result = "added"
+            elif row["status"] == "done" and not self.output_intact(row["output_path"], row["output_hash"]):
+                self.db.execute(
+                    "UPDATE jobs SET status = 'pending', output_hash = NULL, error = NULL, "
+                    "attempts = 0, worker = NULL WHERE id = ?",
+                    (row["id"],),
+                )
+                result = "requeued"
+            elif row["status"] == "failed":
+                self.db.execute(
+                    "UPDATE jobs SET status = 'pending', attempts = 0, error = NULL WHERE id = ?",
+                    (row["id"],),
+                )
+                result = "requeued"
+            else:
+                result = "exists"
+
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return result
+
+    @staticmethod
+    def output_intact(output_path, output_hash):
+        return (output_hash is not None and os.path.exists(output_path)
+                and file_hash(output_path).hexdigest() == output_hash)
+
+    def claim(self, worker=None, limit=1, same_image=True):
+        """
+        Atomically claim up to `limit` jobs for this worker.
+        With same_image, all claimed jobs share one input image (and tier),
+        so they can run as one batch on the same control images.
+        """
+        worker = worker or default_worker_id()
+        now = time.time()
+        claimable = "(status = 'pending' OR (status = 'running' AND claimed_at < ?))"
+        expired = now - self.lease_seconds
+
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            first = self.db.execute(
+                f"SELECT * FROM jobs WHERE {claimable} ORDER BY id LIMIT 1", (expired,)
+            ).fetchone()
+            if first is None:
+                self.db.execute("COMMIT")
+                return []
+
+            if same_image and limit > 1:
+                rows = self.db.execute(
+                    f"SELECT * FROM jobs WHERE {claimable} AND image = ? ORDER BY id",
+                    (expired, first["image"]),
+                ).fetchall()
+                tier = json.loads(first["params"]).get("tier")
+                rows = [r for r in rows if json.loads(r["params"]).get("tier") == tier][:limit]
+            else:
+                rows = self.db.execute(
+                    f"SELECT * FROM jobs WHERE {claimable} ORDER BY id LIMIT ?", (expired, limit)
+                ).fetchall()
+
+            self.db.executemany(
+                "UPDATE jobs SET status = 'running', worker = ?, claimed_at = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                [(worker, now, row["id"]) for row in rows],
+            )
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job.update(status="running", worker=worker, claimed_at=now, attempts=row["attempts"] + 1)
+            job["params"] = json.loads(job["params"])
+            jobs.append(job)
+        return jobs
+
+    # complete / fail / release only touch a job this worker still holds: after
+    # its lease expired another worker may have claimed it, and then they return
+    # False and change nothing.
+
+    def complete(self, job_id, worker):
+        """Mark a job done and record its output's hash"""
+        row = self.db.execute("SELECT output_path FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        cursor = self.db.execute(
+            "UPDATE jobs SET status = 'done', output_hash = ?, error = NULL, finished_at = ? "
+            "WHERE id = ? AND status = 'running' AND worker = ?",
+            (file_hash(row["output_path"]).hexdigest(), time.time(), job_id, worker),
+        )
+        return cursor.rowcount > 0
+
+    def fail(self, job_id, worker, error, max_attempts=3):
+        """Put a job back in the queue, or mark it failed after max_attempts"""
+        cursor = self.db.execute(
+            "UPDATE jobs SET error = ?, finished_at = ?, "
+            "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END "
+            "WHERE id = ? AND status = 'running' AND worker = ?",
+            (str(error), time.time(), max_attempts, job_id, worker),
+        )
+        return cursor.rowcount > 0
+
+    def release(self, job_ids, worker):
+        """Hand claimed jobs back untouched (worker interrupted), not counting the attempt"""
+        self.db.executemany(
+            "UPDATE jobs SET status = 'pending', worker = NULL, attempts = attempts - 1 "
+            "WHERE id = ? AND status = 'running' AND worker = ?",
+            [(job_id, worker) for job_id in job_ids],
+        )
+
+    def status(self):
+        """Job counts by status, overall and per input image"""
+        counts = {status: 0 for status in STATUSES}
+        for row in self.db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+            counts[row["status"]] = row["n"]
+
+        images = {}
+        for row in self.db.execute("SELECT image, status, COUNT(*) AS n FROM jobs GROUP BY image, status"):
+            images.setdefault(row["image"], {status: 0 for status in STATUSES})[row["status"]] = row["n"]
+
+        return {"total": sum(counts.values()), **counts, "images": images}
+
+    def failures(self):
+        return [dict(row) for row in self.db.execute(
+            "SELECT id, image, style, attempts, error FROM jobs WHERE status = 'failed' ORDER BY id"
+        )]
@@ -0,0 +1,120 @@
+"""
+Label Maps
+One uint8 label image per room instead of one PNG per class.
+
+<name>_labels.png   indexed (palette) PNG; pixel value = class id, the
+                    palette makes it viewable as a colored segmentation map
+<name>_labels.json  sidecar with class names and pixel counts
+
+Binary masks for single classes are derived on demand with LabelMap.mask().
+Label maps written with the ADE20K palette (utils/ade20k.py) are already a
+ControlNet segmentation image: LabelMap.color_image() is the conditioning input.
+"""
+
+import os
+import json
+import numpy as np
+from PIL import Image
+
+
+def label_map_paths(folder, name):
+    return (os.path.join(folder, f"{name}_labels.png"),
+            os.path.join(folder, f"{name}_labels.json"))
+
+
+def save_label_map(predictions, folder, name, class_names, counts, min_pixels, palette,
+                   palette_name=None):
+    """
+    Write the label PNG and its sidecar.
+    predictions: [H, W] uint8 class ids, counts: pixel count per class id,
+    palette: [256, 3] uint8 colors used when viewing the PNG.
+    palette_name marks a fixed palette (e.g. "ade20k") whose colors mean
+    something to downstream models, not just for display.
+    """
+    png_path, json_path = label_map_paths(folder, name)
+
+    label_img = Image.fromarray(predictions)
+    label_img.putpalette(np.asarray(palette, dtype=np.uint8).ravel().tolist())
+    label_img.save(png_path, optimize=True)
+
+    classes = {}
+    for class_id in np.flatnonzero(counts):
+        if class_id == 0:
+            continue
+        classes[str(class_id)] = {
+            "name": class_names[class_id] if class_id < len(class_names) else 'unknown',
+            "pixels": int(counts[class_id]),
+        }
+
+    sidecar = {
+        "image": name,
+        "shape": list(predictions.shape),
+        "min_mask_pixels": min_pixels,
+        "classes": classes,
+    }
+    if palette_name:
+        sidecar["palette"] = palette_name
+    with open(json_path, 'w') as f:
+        json.dump(sidecar, f, indent=2)
+
+    return png_path, json_path
+
+
+class LabelMap:
+    """Sidecar read eagerly, label image decoded only when a mask is needed"""
+
+    def __init__(self, png_path, json_path):
+        self.png_path = png_path
+        with open(json_path, 'r') as f:
+            self.info = json.load(f)
+        self._labels = None
+
+    @classmethod
+    def find(cls, folder, name=None):
+        """Label map in a room's mask folder, or None if it was not written"""
+        name = name or os.path.basename(os.path.normpath(folder))
+        png_path, json_path = label_map_paths(folder, name)
+        if os.path.exists(png_path) and os.path.exists(json_path):
+            return cls(png_path, json_path)
+        return None
+
+    @property
+    def labels(self):
+        if self._labels is None:
+            # np.array on a palette image keeps the raw indices (= class ids)
+            self._labels = np.array(Image.open(self.png_path))
+        return self._labels
+
+    @property
+    def shape(self):
+        return tuple(self.info["shape"])
+
+    @property
+    def palette_name(self):
+        return self.info.get("palette")
+
+    def color_image(self):
+        """The label map drawn with its palette, as an RGB image"""
+        return Image.open(self.png_path).convert('RGB')
+
+    def classes(self, include_small=False):
+        """{class_id: name} for classes big enough to count as objects"""
+        min_pixels = self.info.get("min_mask_pixels", 0)
+        return {
+            int(class_id): data["name"]
+            for class_id, data in self.info["classes"].items()
+            if include_small or data["pixels"] > min_pixels
+        }
+
+    def pixels(self, class_id):
+        return self.info["classes"].get(str(class_id), {}).get("pixels", 0)
+
+    def mask(self, class_ids):
+        """Boolean mask for one class id or a list of them"""
+        if np.isscalar(class_ids):
+            return self.labels == class_ids
+        return np.isin(self.labels, list(class_ids))
+
+    def mask_image(self, class_ids):
+        """Same mask as a 0/255 grayscale image, like the old per-class PNGs"""
+        return Image.fromarray(self.mask(class_ids).astype(np.uint8) * 255)
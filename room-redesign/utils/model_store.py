@@ -0,0 +1,310 @@
+"""
+Local Model Store
+Exports the depth and segmentation models once, then loads them from disk
+without torch.hub, so the generators start fast and work without a network.
+
+Run once on a machine with internet access (from the room-redesign folder):
+    python -m utils.model_store export
+
+Then copy the models/ folder to the render nodes.
+
+mmap_safetensors / map_model_weights memory-map safetensors weights, so
+processes on one host (worker_pool.py) share a single copy of a model;
+mapped_bytes tells how much of a model is still backed by those maps.
+"""
+
+import os
+import sys
+import json
+import mmap
+import struct
+import cv2
+import numpy as np
+import torch
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models")
+
+MIDAS_REPO = "intel-isl/MiDaS"
+MIDAS_SMALL_FILE = "midas_small.torchscript.pt"
+
+# torchvision segmentation models we can store as plain state dicts
+SEGMENTATION_MODELS = [
+    "deeplabv3_resnet50",
+    "deeplabv3_mobilenet_v3_large",
+    "lraspp_mobilenet_v3_large",
+]
+VISION_REPO = "pytorch/vision:v0.10.0"
+
+# ADE20K models for ControlNet-compatible segmentation (transformers format)
+ADE20K_MODELS = {
+    "segformer-b0": "nvidia/segformer-b0-finetuned-ade-512-512",
+    "upernet-convnext-small": "openmmlab/upernet-convnext-small",
+}
+
+# Weight files of diffusers / transformers models, in lookup order
+SAFETENSORS_FILES = ["diffusion_pytorch_model.safetensors", "model.safetensors"]
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8,
+    "U8": torch.uint8, "BOOL": torch.bool,
+}
+
+# MiDaS small_transform settings (see midas/transforms.py in the MiDaS repo)
+# Address ranges of the memory maps made by mmap_safetensors
+MAPPED_RANGES = []
+
+MIDAS_SMALL_SIZE = 256
+MIDAS_MULTIPLE_OF = 32
+MIDAS_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+MIDAS_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+def model_path(filename, model_dir=None):
+    return os.path.join(model_dir or MODELS_DIR, filename)
+
+
+def segmentation_file(name):
+    return f"{name}.state_dict.pt"
+
+
+def _constrain_to_multiple_of(x, max_val):
+    y = int(np.round(x / MIDAS_MULTIPLE_OF) * MIDAS_MULTIPLE_OF)
+    if y > max_val:
+        y = int(np.floor(x / MIDAS_MULTIPLE_OF) * MIDAS_MULTIPLE_OF)
+    return y
+
+
+def midas_small_transform(img_np):
+    """
+    Same result as torch.hub's MiDaS small_transform, without the hub code:
+    fit inside 256x256 keeping aspect ratio, snap to multiples of 32,
+    normalize, and return a [1, 3, H, W] float tensor.
+    """
+    height, width = img_np.shape[:2]
+    scale = min(MIDAS_SMALL_SIZE / height, MIDAS_SMALL_SIZE / width)
+    new_height = _constrain_to_multiple_of(scale * height, MIDAS_SMALL_SIZE)
+    new_width = _constrain_to_multiple_of(scale * width, MIDAS_SMALL_SIZE)
+
+    image = img_np / 255.0
+    image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
+    image = (image - MIDAS_MEAN) / MIDAS_STD
+    image = np.ascontiguousarray(np.transpose(image, (2, 0, 1))).astype(np.float32)
+    return torch.from_numpy(image).unsqueeze(0)
+
+
+def _load_state_dict(path):
+    """Load a state dict memory-mapped when this torch version supports it"""
+    try:
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=True), True
+    except TypeError:
+        # torch < 2.1 has no mmap argument
+        return torch.load(path, map_location="cpu"), False
+
+
+def mmap_safetensors(path):
+    """
+    Tensors of a .safetensors file that point straight into a memory map of it,
+    instead of being read into process memory. The pages belong to the page
+    cache, so every process mapping the file shares one copy. The map is
+    private: a write would copy the page instead of changing the file.
+    """
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    base = torch.frombuffer(buffer, dtype=torch.uint8, count=1).data_ptr()
+    MAPPED_RANGES.append((base, base + len(buffer)))
+
+    data_start = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        if end == begin:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        tensor = torch.frombuffer(buffer, dtype=dtype, count=(end - begin) // dtype.itemsize,
+                                  offset=data_start + begin)
+        tensors[name] = tensor.reshape(info["shape"])
+    return tensors
+
+
+def safetensors_file(model):
+    """
+    The single-file safetensors weights a diffusers / transformers model was
+    loaded from (a local folder or the Hugging Face cache), or None
+    """
+    source = getattr(model.config, "_name_or_path", None)
+    if not source:
+        return None
+
+    for filename in SAFETENSORS_FILES:
+        if os.path.isdir(source):
+            path = os.path.join(source, filename)
+            if os.path.exists(path):
+                return path
+            continue
+        try:
+            from huggingface_hub import try_to_load_from_cache
+        except ImportError:
+            return None
+        path = try_to_load_from_cache(source, filename)
+        if isinstance(path, str):
+            return path
+    return None
+
+
+def map_model_weights(model, path=None):
+    """
+    Swap a loaded model's weights for memory-mapped ones from its safetensors
+    file (assign=True keeps the mapped tensors instead of copying them).
+    Weights stored in another dtype than the model uses keep their loaded copy.
+    Returns the number of bytes now mapped.
+    """
+    path = path or safetensors_file(model)
+    if path is None:
+        return 0
+
+    current = model.state_dict()
+    state_dict = {
+        name: tensor for name, tensor in mmap_safetensors(path).items()
+        if name in current and current[name].dtype == tensor.dtype and current[name].shape == tensor.shape
+    }
+    model.load_state_dict(state_dict, strict=False, assign=True)
+    return sum(tensor.nbytes for tensor in state_dict.values())
+
+
+def mapped_bytes(model):
+    """
+    Bytes of a model's weights that still point into a memory map. Converting
+    a mapped weight (dtype, channels-last, ...) leaves a private copy instead.
+    """
+    total = 0
+    seen = set()
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        storage = tensor.untyped_storage()
+        ptr = storage.data_ptr()
+        if ptr in seen:
+            continue
+        seen.add(ptr)
+        if any(start <= ptr < end for start, end in MAPPED_RANGES):
+            total += storage.nbytes()
+    return total
+
+
+def has_midas_small(model_dir=None):
+    return os.path.exists(model_path(MIDAS_SMALL_FILE, model_dir))
+
+
+def load_midas_small(model_dir=None):
+    """Load the exported MiDaS_small TorchScript module"""
+    model = torch.jit.load(model_path(MIDAS_SMALL_FILE, model_dir), map_location="cpu")
+    model.eval()
+    return model
+
+
+def has_segmentation_model(name, model_dir=None):
+    return os.path.exists(model_path(segmentation_file(name), model_dir))
+
+
+def build_segmentation_model(name):
+    """Create an untrained torchvision segmentation model with the pretrained layout"""
+    from torchvision.models import segmentation
+
+    builder = getattr(segmentation, name)
+    # Pretrained DeepLab weights include the auxiliary head; LR-ASPP has none
+    kwargs = {"num_classes": 21}
+    if name.startswith("deeplabv3"):
+        kwargs["aux_loss"] = True
+    try:
+        return builder(weights=None, weights_backbone=None, **kwargs)
+    except TypeError:
+        # torchvision < 0.13
+        return builder(pretrained=False, pretrained_backbone=False, **kwargs)
+
+
+def load_segmentation_model(name, model_dir=None):
+    """Build the model and attach the stored weights (memory-mapped where possible)"""
+    model = build_segmentation_model(name)
+    state_dict, mmapped = _load_state_dict(model_path(segmentation_file(name), model_dir))
+    if mmapped:
+        # assign=True keeps the mmapped tensors instead of copying into fresh ones
+        model.load_state_dict(state_dict, assign=True)
+    else:
+        model.load_state_dict(state_dict)
+    model.eval()
+    return model
+
+
+def has_ade20k_model(name, model_dir=None):
+    return os.path.isdir(model_path(name, model_dir))
+
+
+def load_ade20k_model(name, model_dir=None):
+    """Segformer / UperNet from the store if exported, else from the Hugging Face Hub"""
+    from transformers import AutoModelForSemanticSegmentation
+
+    source = model_path(name, model_dir) if has_ade20k_model(name, model_dir) else ADE20K_MODELS[name]
+    model = AutoModelForSemanticSegmentation.from_pretrained(source)
+    model.eval()
+    return model
+
+
+def export_midas_small(model_dir=None):
+    print("📦 Exporting MiDaS_small...")
+    model = torch.hub.load(MIDAS_REPO, "MiDaS_small")
+    model.eval()
+
+    # Tracing is valid for every input the transform produces: sizes are
+    # multiples of 32, so the backbone's "same" padding never changes.
+    example = torch.zeros(1, 3, MIDAS_SMALL_SIZE, MIDAS_SMALL_SIZE)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+
+    path = model_path(MIDAS_SMALL_FILE, model_dir)
+    traced.save(path)
+    print(f"   💾 Saved: {path}")
+
+
+def export_segmentation_model(name, model_dir=None):
+    print(f"📦 Exporting {name}...")
+    model = torch.hub.load(VISION_REPO, name, pretrained=True)
+    path = model_path(segmentation_file(name), model_dir)
+    torch.save(model.state_dict(), path)
+    print(f"   💾 Saved: {path}")
+
+
+def export_ade20k_model(name, model_dir=None):
+    from transformers import AutoModelForSemanticSegmentation
+
+    print(f"📦 Exporting {name}...")
+    model = AutoModelForSemanticSegmentation.from_pretrained(ADE20K_MODELS[name])
+    path = model_path(name, model_dir)
+    model.save_pretrained(path)
+    print(f"   💾 Saved: {path}")
+
+
+def export_all(model_dir=None):
+    os.makedirs(model_dir or MODELS_DIR, exist_ok=True)
+    export_midas_small(model_dir)
+    for name in SEGMENTATION_MODELS:
+        export_segmentation_model(name, model_dir)
+    for name in ADE20K_MODELS:
+        export_ade20k_model(name, model_dir)
+    print("✅ Model store ready")
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != "export":
+        print("Usage: python -m utils.model_store export [models_dir]")
+        return
+
+    model_dir = sys.argv[2] if len(sys.argv) > 2 else None
+    export_all(model_dir)
+
+
+if __name__ == "__main__":
+    main()
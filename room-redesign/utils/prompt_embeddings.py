@@ -0,0 +1,164 @@
+"""
+Prompt Embedding Cache
+CLIP text embeddings for Stable Diffusion prompts, computed once and reused.
+
+PromptGenerator produces a small fixed set of templates and negatives, so the
+same texts are encoded over and over. Embeddings are kept in an in-memory LRU
+and written to <cache_dir>/<key>.safetensors; the key covers the model id, the
+tokenizer, the text encoder's dtype and the prompt text, so switching models
+or precision never reuses stale entries.
+
+Pre-encode every prompt in prompts.json (from the room-redesign folder):
+    python -m utils.prompt_embeddings warm-up data/prompts/prompts.json
+"""
+
+import os
+import sys
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import torch
+
+DEFAULT_MODEL_ID = "runwayml/stable-diffusion-v1-5"
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "cache", "prompt_embeds"
+)
+
+
+class PromptEmbeddingCache:
+    """Maps prompt text to its [77, dim] CLIP embedding"""
+
+    def __init__(self, tokenizer, text_encoder, model_id=DEFAULT_MODEL_ID,
+                 cache_dir=DEFAULT_CACHE_DIR, maxsize=256):
+        self.tokenizer = tokenizer
+        self.text_encoder = text_encoder
+        self.model_id = model_id
+        self.cache_dir = cache_dir
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @classmethod
+    def for_pipeline(cls, pipe, model_id=DEFAULT_MODEL_ID, **kwargs):
+        return cls(pipe.tokenizer, pipe.text_encoder, model_id, **kwargs)
+
+    def key(self, text):
+        # Not tokenizer.name_or_path: that is a local snapshot path when the
+        # pipeline loads the model, and a hub id when loaded on its own
+        tokenizer_id = f"{type(self.tokenizer).__name__}-{len(self.tokenizer)}-{self.tokenizer.model_max_length}"
+        # bfloat16 and float32 encoders give different embeddings
+        dtype = str(self.text_encoder.dtype)
+        digest = hashlib.sha256(f"{self.model_id}|{tokenizer_id}|{dtype}|{text}".encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.safetensors")
+
+    def _remember(self, key, embeds):
+        with self.lock:
+            self.items[key] = embeds
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def _lookup(self, key):
+        with self.lock:
+            embeds = self.items.get(key)
+            if embeds is not None:
+                self.items.move_to_end(key)
+                return embeds
+
+        if self.cache_dir and os.path.exists(self._path(key)):
+            from safetensors.torch import load_file
+
+            embeds = load_file(self._path(key))["embeds"]
+            self._remember(key, embeds)
+            return embeds
+        return None
+
+    def _encode(self, texts):
+        """Same encoding the SD 1.x pipeline does: pad to max length, last hidden state"""
+        input_ids = self.tokenizer(
+            texts,
+            padding="max_length",
+            max_length=self.tokenizer.model_max_length,
+            truncation=True,
+            return_tensors="pt",
+        ).input_ids
+        with torch.no_grad():
+            return self.text_encoder(input_ids.to(self.text_encoder.device))[0].cpu()
+
+    def encode(self, texts):
+        """
+        [len(texts), 77, dim] embeddings on the text encoder's device.
+        Texts not cached yet are encoded together in one forward pass.
+        """
+        keys = [self.key(text) for text in texts]
+        found = {key: self._lookup(key) for key in set(keys)}
+        missing = [key for key, embeds in found.items() if embeds is None]
+        self.hits += len(found) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            missing_texts = [texts[keys.index(key)] for key in missing]
+            for key, embeds in zip(missing, self._encode(missing_texts)):
+                embeds = embeds.contiguous()
+                if self.cache_dir:
+                    from safetensors.torch import save_file
+
+                    # Per-process name: forked workers may encode the same prompt at once
+                    tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+                    save_file({"embeds": embeds}, tmp_path)
+                    os.replace(tmp_path, self._path(key))
+                self._remember(key, embeds)
+                found[key] = embeds
+
+        return torch.stack([found[key] for key in keys]).to(self.text_encoder.device)
+
+    def warm_up(self, all_prompts, batch_size=32):
+        """
+        Pre-encode every positive and negative prompt from prompts.json
+        (a file path or the already loaded dict). Returns the number of texts.
+        """
+        if isinstance(all_prompts, str):
+            with open(all_prompts, 'r') as f:
+                all_prompts = json.load(f)
+
+        texts = sorted({
+            text
+            for prompts in all_prompts.values()
+            for style_data in prompts.values()
+            for text in (style_data['positive'], style_data['negative'])
+        })
+        for i in range(0, len(texts), batch_size):
+            self.encode(texts[i:i + batch_size])
+        return len(texts)
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] != "warm-up":
+        print("Usage: python -m utils.prompt_embeddings warm-up <prompts.json> [model_id]")
+        return
+
+    from transformers import CLIPTextModel, CLIPTokenizer
+
+    model_id = sys.argv[3] if len(sys.argv) > 3 else DEFAULT_MODEL_ID
+    print(f"🔄 Loading text encoder from {model_id}...")
+    tokenizer = CLIPTokenizer.from_pretrained(model_id, subfolder="tokenizer")
+    text_encoder = CLIPTextModel.from_pretrained(model_id, subfolder="text_encoder")
+    text_encoder.eval()
+
+    cache = PromptEmbeddingCache(tokenizer, text_encoder, model_id)
+    count = cache.warm_up(sys.argv[2])
+    print(f"✅ {count} prompts cached ({cache.misses} newly encoded) in {cache.cache_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Render Cache
+Generated images stored under a key of everything that determines them:
+model ids, prompt embeddings, control images, sampler, steps, guidance and
+seed. A repeated request (a rerun, the web UI, the video stage) is served
+from disk instead of running the pipeline again.
+
+Images are PNGs in <cache_dir>/<key[:2]>/<key>.png. When the cache grows
+past max_bytes, the least recently used images are removed.
+"""
+
+import os
+import json
+import hashlib
+import threading
+
+from PIL import Image
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "cache", "renders"
+)
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def image_hash(image):
+    """Hash of an image's pixels, size and mode"""
+    digest = hashlib.sha256(f"{image.mode}|{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def render_key(**conditioning):
+    """Key of one render; conditioning values must be JSON serializable"""
+    return hashlib.sha256(json.dumps(conditioning, sort_keys=True).encode()).hexdigest()
+
+
+class RenderCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(size for _, _, size in self._entries())
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.png")
+
+    def _entries(self):
+        """(last used, path, size) of every cached image"""
+        entries = []
+        for folder, _, files in os.walk(self.cache_dir):
+            for f in files:
+                if f.endswith('.png'):
+                    stat = os.stat(os.path.join(folder, f))
+                    entries.append((stat.st_mtime, os.path.join(folder, f), stat.st_size))
+        return entries
+
+    def get(self, key):
+        """The cached image, or None"""
+        path = self._path(key)
+        try:
+            image = Image.open(path)
+            image.load()
+        except OSError:
+            self.misses += 1
+            return None
+
+        # mtime marks last use, for eviction
+        os.utime(path)
+        self.hits += 1
+        return image
+
+    def put(self, key, image):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Written aside and renamed, so readers never see a partial PNG
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        image.save(tmp_path, format='PNG')
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.total_bytes += os.path.getsize(path)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """Remove least recently used images until the cache fits in max_bytes"""
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.total_bytes = total
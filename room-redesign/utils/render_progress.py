@@ -0,0 +1,198 @@
+"""
+Render Progress
+Live previews and cancellation for running Stable Diffusion renders.
+
+A step callback turns the latents into a rough RGB preview every few steps
+with the SD 1.5 latent-to-RGB factors (one 4x3 matrix product, no VAE), and
+publishes it with the step count to a progress channel: files in
+data/progress/<name>.json / <name>.png that the web UI, check scripts or an
+operator can read from any process. Dropping <name>.cancel next to them
+interrupts the render at the next step.
+
+From the room-redesign folder:
+    python -m utils.render_progress status
+    python -m utils.render_progress cancel <name>
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+
+import torch
+from PIL import Image
+
+DEFAULT_PROGRESS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "progress"
+)
+
+# Linear approximation of the SD 1.x VAE decoder: latent channels -> RGB
+SD15_LATENT_RGB_FACTORS = torch.tensor([
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177],
+])
+
+
+class RenderCancelled(Exception):
+    """The render was cancelled through its progress channel"""
+
+    def __init__(self, names):
+        super().__init__(f"cancelled: {', '.join(names)}")
+        self.names = names
+
+
+def latents_to_rgb(latents, size=None):
+    """[B, 4, h, w] latents -> list of approximate RGB previews (latent resolution, or size)"""
+    rgb = torch.einsum("bchw,cr->bhwr", latents.float().cpu(), SD15_LATENT_RGB_FACTORS)
+    pixels = ((rgb + 1) * 127.5).clamp(0, 255).to(torch.uint8).numpy()
+    previews = [Image.fromarray(p) for p in pixels]
+    if size is not None:
+        previews = [p.resize(size, Image.BILINEAR) for p in previews]
+    return previews
+
+
+class RenderProgress:
+    """
+    Progress channel of one pipeline call, one name per sample
+    (e.g. the queue's job ids). Cancelling any sample stops the whole call,
+    since the samples share one denoising loop.
+    """
+
+    def __init__(self, names, progress_dir=DEFAULT_PROGRESS_DIR):
+        self.names = list(names)
+        self.progress_dir = progress_dir
+        self.cancel_event = threading.Event()
+        os.makedirs(progress_dir, exist_ok=True)
+
+    def subset(self, indices):
+        """Channel for some of the samples, cancelled together with this one"""
+        channel = RenderProgress([self.names[i] for i in indices], self.progress_dir)
+        channel.cancel_event = self.cancel_event
+        return channel
+
+    def _path(self, name, ext):
+        return os.path.join(self.progress_dir, f"{name}.{ext}")
+
+    def _write_status(self, name, status):
+        # Written aside and renamed, so readers never see a partial file
+        tmp_path = self._path(name, "json.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(status, f)
+        os.replace(tmp_path, self._path(name, "json"))
+
+    def publish(self, step, total, previews=None):
+        for i, name in enumerate(self.names):
+            if previews is not None:
+                tmp_path = self._path(name, "tmp.png")
+                previews[i].save(tmp_path)
+                os.replace(tmp_path, self._path(name, "png"))
+            self._write_status(name, {"status": "running", "step": step, "total": total,
+                                      "updated": time.time()})
+
+    def finish(self, status, names=None):
+        """
+        Final status: 'done', 'cancelled' or 'failed', for all samples or only
+        `names`; their cancel requests are cleared
+        """
+        for name in (self.names if names is None else names):
+            self._write_status(name, {"status": status, "updated": time.time()})
+            if os.path.exists(self._path(name, "cancel")):
+                os.remove(self._path(name, "cancel"))
+
+    def cancel(self):
+        """Cancel from this process"""
+        self.cancel_event.set()
+
+    def cancelled(self):
+        """Names with a cancel request (all of them after cancel())"""
+        if self.cancel_event.is_set():
+            return list(self.names)
+        return [name for name in self.names if os.path.exists(self._path(name, "cancel"))]
+
+
+def request_cancel(name, progress_dir=DEFAULT_PROGRESS_DIR):
+    """Cancel a render from any process"""
+    os.makedirs(progress_dir, exist_ok=True)
+    open(os.path.join(progress_dir, f"{name}.cancel"), 'w').close()
+
+
+def read_status(progress_dir=DEFAULT_PROGRESS_DIR):
+    """{name: status dict} of every render that published progress"""
+    statuses = {}
+    if not os.path.exists(progress_dir):
+        return statuses
+    for f in sorted(os.listdir(progress_dir)):
+        if f.endswith('.json'):
+            try:
+                with open(os.path.join(progress_dir, f), 'r') as fh:
+                    statuses[f[:-5]] = json.load(fh)
+            except (OSError, ValueError):
+                continue
+    return statuses
+
+
+class PreviewCallback:
+    """
+    callback_on_step_end that publishes a preview every `every` steps and
+    interrupts the pipeline (pipe._interrupt) once cancellation is requested
+    """
+
+    def __init__(self, progress, every=5, preview_size=(256, 256)):
+        self.progress = progress
+        self.every = every
+        self.preview_size = preview_size
+
+    def __call__(self, pipe, step, timestep, callback_kwargs):
+        total = pipe.num_timesteps
+        done = step + 1
+        if done % self.every == 0 or done == total:
+            latents = callback_kwargs["latents"]
+            self.progress.publish(done, total, latents_to_rgb(latents, self.preview_size))
+        else:
+            self.progress.publish(done, total)
+
+        if self.progress.cancelled():
+            pipe._interrupt = True
+        return callback_kwargs
+
+
+def chain_callbacks(callbacks):
+    """Run several callback_on_step_end hooks in order (the pipeline takes one)"""
+    callbacks = [callback for callback in callbacks if callback is not None]
+    if not callbacks:
+        return None
+    if len(callbacks) == 1:
+        return callbacks[0]
+
+    def chained(pipe, step, timestep, callback_kwargs):
+        for callback in callbacks:
+            callback_kwargs = callback(pipe, step, timestep, callback_kwargs)
+        return callback_kwargs
+
+    return chained
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+
+    if command == 'cancel' and len(sys.argv) > 2:
+        for name in sys.argv[2:]:
+            request_cancel(name)
+            print(f"⏹️  Cancel requested: {name}")
+        return
+
+    statuses = read_status()
+    if not statuses:
+        print("No renders in progress")
+    for name, status in statuses.items():
+        if status["status"] == "running":
+            print(f"🎨 {name}: step {status['step']}/{status['total']}")
+        else:
+            print(f"   {name}: {status['status']}")
+
+
+if __name__ == "__main__":
+    main()